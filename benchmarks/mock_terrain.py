@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+import argparse
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# The resource types known to the mock server.
+resource_types = [
+    {"id": "1", "name": "cpu.hours", "unit": "cpu hours"},
+    {"id": "2", "name": "data.size", "unit": "bytes"},
+]
+
+# The default quotas for each plan known to the mock server.
+plan_quotas = {
+    "Basic": {"cpu.hours": 20.0, "data.size": 5368709120.0},
+    "Regular": {"cpu.hours": 100.0, "data.size": 53687091200.0},
+    "Pro": {"cpu.hours": 2000.0, "data.size": 3298534883328.0},
+    "Commercial": {"cpu.hours": 5000.0, "data.size": 5497558138880.0},
+}
+
+def make_token(username, lifetime=3600):
+    """
+    Creates an unsigned JWT for a user. The CLI only decodes the payload, so no signature is needed.
+    """
+    encode = lambda obj: base64.urlsafe_b64encode(json.dumps(obj).encode()).decode().rstrip("=")
+    now = int(time.time())
+    payload = {"preferred_username": username, "iat": now, "nbf": now - 60, "exp": now + lifetime}
+    return "{0}.{1}.mock".format(encode({"alg": "none"}), encode(payload))
+
+class MockTerrain:
+    """
+    The state of a mock Terrain server: a set of users, each with a subscription, along with the latency and error rate
+    to inject into responses and a count of the requests received for each endpoint.
+    """
+
+    def __init__(self, users=1000, latency=0.0, jitter=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.subscriptions = {}
+        for i in range(users):
+            username = "user{0}".format(i)
+            self.subscribe(username, list(plan_quotas)[i % len(plan_quotas)])
+            for usage in self.subscriptions[username]["usages"]:
+                usage["usage"] = self.random.uniform(0, 1.2) * plan_quotas["Basic"][usage["resource_type"]["name"]]
+
+    def subscribe(self, username, plan_name):
+        """
+        Creates a new subscription for a user.
+        """
+        self.subscriptions[username] = {
+            "id": username,
+            "effective_start_date": "2023-01-01T00:00:00Z",
+            "effective_end_date": "2024-01-01T00:00:00Z",
+            "plan": {"name": plan_name},
+            "quotas": [
+                {"resource_type": {"name": name}, "quota": quota} for name, quota in plan_quotas[plan_name].items()
+            ],
+            "usages": [{"resource_type": {"name": rt["name"]}, "usage": 0.0} for rt in resource_types],
+        }
+        return self.subscriptions[username]
+
+    def count(self, endpoint):
+        """
+        Counts a request to an endpoint.
+        """
+        with self.lock:
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+
+    def reset_counts(self):
+        """
+        Resets the request counts and returns the previous counts.
+        """
+        with self.lock:
+            counts, self.counts = self.counts, {}
+            return counts
+
+    def delay(self):
+        """
+        Waits for the configured latency and determines whether or not the request should fail.
+        """
+        with self.lock:
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            fail = self.random.random() < self.error_rate
+        time.sleep(delay)
+        return fail
+
+    def handle(self, method, path, query, body):
+        """
+        Handles a single request. Returns the response status and body.
+        """
+        if path == "/token/keycloak" and method == "GET":
+            return 200, {"access_token": make_token("admin"), "expires_in": 3600}
+        if path == "/qms/plans" and method == "GET":
+            plans = [
+                {
+                    "name": name,
+                    "plan_quota_defaults": [
+                        {"resource_type": {"name": rt}, "quota_value": value} for rt, value in quotas.items()
+                    ],
+                }
+                for name, quotas in plan_quotas.items()
+            ]
+            return 200, {"result": plans}
+        if path == "/qms/resource-types" and method == "GET":
+            return 200, {"result": resource_types}
+        if path == "/qms/user/plan" and method == "GET":
+            return 200, {"result": self.subscriptions.get("admin") or self.subscribe("admin", "Basic")}
+        if path == "/subjects" and method == "GET":
+            search = query.get("search", [""])[0]
+            subjects = [{"id": u, "source_id": "ldap"} for u in self.subscriptions if search in u]
+            return 200, {"subjects": subjects}
+
+        m = re.match(r"^/admin/qms/users/([^/]+)/plan(?:/([^/]+)(/quota)?)?$", path)
+        if m is None:
+            return 404, {"error_code": "ERR_NOT_FOUND"}
+        username, name, quota = m.groups()
+        with self.lock:
+            if method == "GET" and name is None:
+                if username not in self.subscriptions:
+                    return 404, {"error_code": "ERR_NOT_FOUND"}
+                return 200, {"result": self.subscriptions[username]}
+            if method == "PUT" and name is not None and quota is None:
+                plan_name = next((p for p in plan_quotas if p.lower() == name.lower()), None)
+                if plan_name is None:
+                    return 400, {"error_code": "ERR_BAD_REQUEST"}
+                return 200, {"result": self.subscribe(username, plan_name)}
+            if method == "POST" and quota is not None:
+                subscription = self.subscriptions.get(username) or self.subscribe(username, "Basic")
+                value = json.loads(body)["quota"]
+                quotas = [q for q in subscription["quotas"] if q["resource_type"]["name"] != name]
+                subscription["quotas"] = quotas + [{"resource_type": {"name": name}, "quota": value}]
+                return 200, {"result": subscription}
+        return 405, {"error_code": "ERR_METHOD_NOT_ALLOWED"}
+
+def endpoint_name(method, path):
+    """
+    Returns the name used to count requests to an endpoint.
+    """
+    path = re.sub(r"^/admin/qms/users/[^/]+", "/admin/qms/users/{user}", path)
+    path = re.sub(r"/plan/[^/]+", "/plan/{name}", path)
+    return "{0} {1}".format(method, path)
+
+def make_handler(terrain):
+    """
+    Creates a request handler class for a mock Terrain server.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def respond(self, method):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length > 0 else b""
+            url = urllib.parse.urlparse(self.path)
+            terrain.count(endpoint_name(method, url.path))
+            if terrain.delay():
+                status, result = 503, {"error_code": "ERR_UNAVAILABLE"}
+            else:
+                status, result = terrain.handle(method, url.path, urllib.parse.parse_qs(url.query), body)
+            payload = json.dumps(result).encode()
+
+            # Successful GET responses carry an ETag so that clients can make conditional requests.
+            etag = '"{0}"'.format(hashlib.sha1(payload).hexdigest()[:16])
+            if method == "GET" and status == 200 and self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            if method == "GET" and status == 200:
+                self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            self.respond("GET")
+
+        def do_PUT(self):
+            self.respond("PUT")
+
+        def do_POST(self):
+            self.respond("POST")
+
+    return Handler
+
+def start_server(terrain, port=0):
+    """
+    Starts a mock Terrain server in a background thread. Returns the server, whose base URL is
+    http://127.0.0.1:{server.server_port}.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(terrain))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def parse_args():
+    """
+    Parses the command-line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Runs a local stand-in for the Terrain endpoints used by the CLI.")
+    parser.add_argument("-p", "--port", type=int, default=8080, help="the port to listen on (default: 8080)")
+    parser.add_argument("--users", type=int, default=1000, help="the number of users to create (default: 1000)")
+    parser.add_argument("--latency", type=float, default=0.0, help="the latency to add to each response, in ms")
+    parser.add_argument("--jitter", type=float, default=0.0, help="the maximum random latency to add, in ms")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="the fraction of requests that fail with 503")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    terrain = MockTerrain(args.users, args.latency / 1000, args.jitter / 1000, args.error_rate)
+    server = start_server(terrain, args.port)
+    print("mock Terrain listening on http://127.0.0.1:{0}".format(server.server_port))
+    print("token for $HOME/.terrain-{{env}}: {0}".format(make_token("admin", 86400)))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import mock_terrain
+import os
+import os.path
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# The path to the CLI entry point.
+terrain = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "terrain.py")
+
+# The single-command scenarios. Each one is run repeatedly to measure its latency.
+command_scenarios = [
+    ("list-plans", ["subscriptions", "list-plans"]),
+    ("list-resource-types", ["subscriptions", "list-resource-types"]),
+    ("get-self", ["subscriptions", "get"]),
+    ("get-user", ["subscriptions", "get", "--user", "user1"]),
+    ("add", ["subscriptions", "add", "--user", "user2", "--plan", "pro"]),
+    ("set-quota", ["subscriptions", "set-quota", "--user", "user3", "--resource-type", "data.size", "--quota", "10G"]),
+]
+
+def run_cli(home, base_url, arguments, cli_options=[], rate_limit=0):
+    """
+    Runs the CLI against the mock server. Returns the wall-clock time in seconds, the peak resident set size of the
+    process in megabytes and the exit status. The CLI's request rate limit is disabled by default so that the
+    benchmarks measure the client rather than the limit.
+    """
+    env = dict(os.environ, HOME=home, TERRAIN_QA_URL=base_url, TERRAIN_QA_RATE_LIMIT=str(rate_limit))
+    command = [sys.executable, terrain, "--env", "qa"] + cli_options + arguments
+    start = time.perf_counter()
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS.
+    rss = usage.ru_maxrss / (1024 * 1024 if platform.system() == "Darwin" else 1024)
+    return elapsed, rss, process.returncode
+
+def percentile(values, p):
+    """
+    Returns a percentile of a list of values using the nearest-rank method.
+    """
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered))) - 1))]
+
+def measure_commands(terrain_state, home, base_url, runs):
+    """
+    Measures the latency, memory usage and number of requests of each single-command scenario.
+    """
+    results = {}
+    for name, arguments in command_scenarios:
+        times, rss = [], []
+        terrain_state.reset_counts()
+        for _ in range(runs):
+            elapsed, peak, status = run_cli(home, base_url, arguments)
+            if status != 0:
+                raise Exception("{0} failed with status {1}".format(name, status))
+            times.append(elapsed * 1000)
+            rss.append(peak)
+        requests = sum(terrain_state.reset_counts().values())
+        results[name] = {
+            "median_ms": statistics.median(times),
+            "p95_ms": percentile(times, 95),
+            "max_rss_mb": max(rss),
+            "requests_per_run": requests / runs,
+        }
+    return results
+
+def write_users(path, count):
+    """
+    Writes a users file containing the first count users known to the mock server.
+    """
+    with open(path, "w") as f:
+        for i in range(count):
+            print("user{0}".format(i), file=f)
+
+def write_manifest(path, count):
+    """
+    Writes a bulk-apply manifest that updates a quota for each of the first count users.
+    """
+    with open(path, "w") as f:
+        print("user,plan,resource_type,quota", file=f)
+        for i in range(count):
+            print("user{0},,data.size,{1}G".format(i, 10 + i % 5), file=f)
+
+def measure_bulk(terrain_state, home, base_url, users, concurrency, rate_limit):
+    """
+    Measures the throughput and memory usage of the subcommands that operate on many users.
+    """
+    users_file = os.path.join(home, "users.txt")
+    manifest = os.path.join(home, "manifest.csv")
+    write_users(users_file, users)
+    write_manifest(manifest, users)
+    scenarios = [
+        ("bulk-apply", ["subscriptions", "bulk-apply", "--file", manifest, "--concurrency", str(concurrency)]),
+        ("get-users-file", ["subscriptions", "get", "--users-file", users_file, "--concurrency", str(concurrency)]),
+        ("report", ["subscriptions", "report", "--users-file", users_file, "--concurrency", str(concurrency)]),
+    ]
+    results = {}
+    for name, arguments in scenarios:
+        terrain_state.reset_counts()
+        elapsed, rss, status = run_cli(home, base_url, arguments, rate_limit=rate_limit)
+        if status != 0:
+            raise Exception("{0} failed with status {1}".format(name, status))
+        results[name] = {
+            "users": users,
+            "seconds": elapsed,
+            "users_per_second": users / elapsed,
+            "max_rss_mb": rss,
+            "requests": sum(terrain_state.reset_counts().values()),
+        }
+    return results
+
+def display_results(results, baseline):
+    """
+    Displays the benchmark results, along with the change from the baseline results if there are any.
+    """
+    def change(section, name, key):
+        if baseline is None or name not in baseline.get(section, {}):
+            return ""
+        previous = baseline[section][name][key]
+        return " ({0:+.1f}%)".format((results[section][name][key] - previous) / previous * 100) if previous else ""
+
+    print("Single commands ({0} runs each):".format(results["settings"]["runs"]))
+    for name, r in results["commands"].items():
+        print("    {0:<20} median {1:7.1f} ms{2:<10} p95 {3:7.1f} ms  rss {4:5.1f} MB  requests {5:.1f}".format(
+            name, r["median_ms"], change("commands", name, "median_ms"), r["p95_ms"], r["max_rss_mb"],
+            r["requests_per_run"]
+        ))
+    print()
+    print("Bulk commands ({0} users, concurrency {1}):".format(
+        results["settings"]["users"], results["settings"]["concurrency"]
+    ))
+    for name, r in results["bulk"].items():
+        print("    {0:<20} {1:8.1f} users/s{2:<10} {3:6.2f} s  rss {4:5.1f} MB  requests {5}".format(
+            name, r["users_per_second"], change("bulk", name, "users_per_second"), r["seconds"], r["max_rss_mb"],
+            r["requests"]
+        ))
+
+def parse_args():
+    """
+    Parses the command-line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Benchmarks the Terrain CLI against a local mock Terrain server.")
+    parser.add_argument("--runs", type=int, default=5, help="the number of runs per command (default: 5)")
+    parser.add_argument("--users", type=int, default=200, help="the number of users for bulk commands (default: 200)")
+    parser.add_argument("--concurrency", type=int, default=8, help="the bulk command concurrency (default: 8)")
+    parser.add_argument("--latency", type=float, default=20.0, help="the latency per response in ms (default: 20)")
+    parser.add_argument("--jitter", type=float, default=5.0, help="the maximum extra latency in ms (default: 5)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="the fraction of requests that fail with 503")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="the CLI request rate limit (default: disabled)")
+    parser.add_argument("--save", help="save the results to this file for use as a baseline")
+    parser.add_argument("--compare", help="compare the results to a baseline saved using --save")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    settings = {
+        k: getattr(args, k) for k in ["runs", "users", "concurrency", "latency", "jitter", "error_rate", "rate_limit"]
+    }
+    terrain_state = mock_terrain.MockTerrain(
+        max(args.users, 10), args.latency / 1000, args.jitter / 1000, args.error_rate
+    )
+    server = mock_terrain.start_server(terrain_state)
+    base_url = "http://127.0.0.1:{0}".format(server.server_port)
+
+    # Each benchmark run gets its own home directory containing a valid token so that the CLI never prompts.
+    home = tempfile.mkdtemp(prefix="terrain-bench-")
+    try:
+        with open(os.path.join(home, ".terrain-qa"), "w") as f:
+            print(mock_terrain.make_token("admin", 86400), file=f)
+        results = {
+            "settings": settings,
+            "commands": measure_commands(terrain_state, home, base_url, args.runs),
+            "bulk": measure_bulk(terrain_state, home, base_url, args.users, args.concurrency, args.rate_limit),
+        }
+    finally:
+        shutil.rmtree(home)
+        server.shutdown()
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    display_results(results, baseline)
+    if args.save is not None:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
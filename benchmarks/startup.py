@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import os.path
+import statistics
+import subprocess
+import sys
+import time
+
+# The path to the CLI entry point.
+terrain = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "terrain.py")
+
+# The commands to measure. None of these send requests to Terrain.
+default_commands = [
+    ["help"],
+    ["subscriptions", "help"],
+]
+
+def wall_times(command, runs):
+    """
+    Runs a command repeatedly and returns the wall-clock time of each run in milliseconds.
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, terrain] + command, stdout=subprocess.DEVNULL, check=True)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+def import_times(command):
+    """
+    Runs a command with python -X importtime and returns a list of tuples containing the cumulative import time in
+    milliseconds and the name of each top-level import made by the CLI, excluding imports made during interpreter
+    startup.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", terrain] + command,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit() and not name.startswith("  ") and name.strip() != "site":
+            imports.append((int(cumulative) / 1000, name.strip()))
+    return sorted(imports, reverse=True)
+
+def parse_args():
+    """
+    Parses the command-line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Measures the startup time of the Terrain CLI.")
+    parser.add_argument("-n", "--runs", type=int, default=10, help="the number of runs per command (default: 10)")
+    parser.add_argument("--top", type=int, default=5, help="the number of slowest imports to list (default: 5)")
+    parser.add_argument("--max-ms", type=float, help="fail if the median startup time of any command exceeds this")
+    parser.add_argument("command", nargs=argparse.REMAINDER, help="a command to measure instead of the defaults")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    commands = [args.command] if len(args.command) > 0 else default_commands
+
+    # Measure the startup time of Python itself so that the CLI's own overhead can be reported separately.
+    python_times = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        python_times.append((time.perf_counter() - start) * 1000)
+    python_median = statistics.median(python_times)
+    print("python -c pass: median {0:.1f} ms".format(python_median))
+
+    failed = False
+    for command in commands:
+        median = statistics.median(wall_times(command, args.runs))
+        print()
+        print("terrain {0}: median {1:.1f} ms ({2:.1f} ms over python)".format(
+            " ".join(command), median, median - python_median
+        ))
+        for cumulative, name in import_times(command)[:args.top]:
+            print("    {0:8.1f} ms  {1}".format(cumulative, name))
+        if args.max_ms is not None and median > args.max_ms:
+            failed = True
+
+    if failed:
+        print("\nstartup time exceeds {0} ms".format(args.max_ms), file=sys.stderr)
+        sys.exit(1)
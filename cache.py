@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import os.path
+import stat
+import threading
+import time
+
+class CatalogCache:
+    """
+    An on-disk cache of Terrain catalog information for a single environment, stored in
+    $HOME/.terrain-cache-{environment}. Catalogs such as the list of subscription plans are stored as named entries
+    along with the time they were fetched. Known usernames are stored individually so that each one can expire on its
+    own. Entries older than the TTL, in seconds, are ignored. If refresh is True then existing entries are ignored but
+    new entries are still stored. If enabled is False then the cache file is neither read nor written.
+    """
+
+    def __init__(self, environment, ttl=3600, enabled=True, refresh=False):
+        self.path = "{0}/.terrain-cache-{1}".format(os.environ["HOME"], environment)
+        self.ttl = ttl
+        self.enabled = enabled
+        self.refresh = refresh
+        self.data = None
+        self.indexes = {}
+        self.dirty = False
+        self.lock = threading.RLock()
+
+    def load(self):
+        """
+        Loads the cache file if it hasn't been loaded already.
+        """
+        if self.data is not None:
+            return self.data
+        self.data = {"catalogs": {}, "subjects": {}}
+        if self.enabled and not self.refresh and os.path.isfile(self.path):
+            try:
+                with open(self.path) as f:
+                    self.data.update(json.load(f))
+            except (OSError, ValueError):
+                pass
+        return self.data
+
+    def fresh(self, fetched):
+        """
+        Determines whether or not an entry fetched at the given time is still fresh.
+        """
+        return time.time() - fetched < self.ttl
+
+    def get(self, name):
+        """
+        Returns a cached catalog, or None if the catalog isn't cached or has expired.
+        """
+        with self.lock:
+            entry = self.load()["catalogs"].get(name)
+            return entry["value"] if entry is not None and self.fresh(entry["fetched"]) else None
+
+    def put(self, name, value):
+        """
+        Stores a catalog in the cache.
+        """
+        with self.lock:
+            self.load()["catalogs"][name] = {"fetched": time.time(), "value": value}
+            self.indexes.pop(name, None)
+            self.dirty = True
+
+    def index(self, name, fetch):
+        """
+        Returns a dictionary mapping lower-case names to the elements of a catalog. The catalog is fetched by calling
+        fetch if it isn't cached. The index is built once and kept in memory until the catalog is replaced.
+        """
+        with self.lock:
+            if name not in self.indexes:
+                catalog = self.get(name)
+                if catalog is None:
+                    catalog = fetch()
+                    self.put(name, catalog)
+                self.indexes[name] = {element["name"].lower(): element for element in catalog}
+            return self.indexes[name]
+
+    def has_subject(self, username):
+        """
+        Determines whether or not a username is known to be valid.
+        """
+        with self.lock:
+            fetched = self.load()["subjects"].get(username)
+            return fetched is not None and self.fresh(fetched)
+
+    def add_subject(self, username):
+        """
+        Records that a username is known to be valid.
+        """
+        with self.lock:
+            self.load()["subjects"][username] = time.time()
+            self.dirty = True
+
+    def subjects(self):
+        """
+        Returns the usernames that are known to be valid.
+        """
+        with self.lock:
+            return [k for k, v in self.load()["subjects"].items() if self.fresh(v)]
+
+    def flush(self):
+        """
+        Writes the cache file if anything has changed. Expired entries are dropped, and the file is replaced atomically
+        so that concurrent invocations never see a partially written cache.
+        """
+        with self.lock:
+            if not self.enabled or not self.dirty:
+                return
+            data = self.load()
+            data["catalogs"] = {k: v for k, v in data["catalogs"].items() if self.fresh(v["fetched"])}
+            data["subjects"] = {k: v for k, v in data["subjects"].items() if self.fresh(v)}
+            tmp_path = "{0}.{1}.tmp".format(self.path, os.getpid())
+            try:
+                fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, stat.S_IRUSR | stat.S_IWUSR)
+                with os.fdopen(fd, "w") as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, self.path)
+                self.dirty = False
+            except OSError:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
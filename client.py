@@ -1,12 +1,22 @@
 #!/usr/bin/env python3
 
+import atexit
+import cache
+import codecs
+import concurrent.futures
+import contextlib
 import getpass
+import json
 import jwt
+import math
 import os
 import os.path
+import re
 import stat
-import requests
 import sys
+import threading
+import throttle
+import time
 
 terrain_base_urls = {
     "prod": "https://de.cyverse.org/terrain",
@@ -15,19 +25,354 @@ terrain_base_urls = {
 
 def terrain_uri(environment, path):
     """
-    Builds a URI that can be used to connect to Terrain.
+    Builds a URI that can be used to connect to Terrain. The base URL for an environment can be overridden using the
+    TERRAIN_{ENVIRONMENT}_URL environment variable (for example, TERRAIN_QA_URL), which is useful for testing against a
+    local stand-in for Terrain.
     """
-    base = terrain_base_urls[environment] if environment in terrain_base_urls else None
+    base = os.environ.get("TERRAIN_{0}_URL".format(environment.upper()), terrain_base_urls.get(environment))
     if not base:
         raise Exception("invalid terrain environment: {0}".format(environment))
     return "{0}{1}".format(base, path)
 
+# The default request rate limits and concurrency limits for each environment. The rate is the sustained number of
+# requests per second and the burst is the number of requests that may be sent at once after a quiet period. Requests
+# in flight start at the initial concurrency and are adjusted between one and the maximum concurrency depending on how
+# well Terrain is keeping up.
+throttle_settings = {
+    "prod": {"rate": 50.0, "burst": 50, "initial_concurrency": 4, "max_concurrency": 32},
+    "qa": {"rate": 20.0, "burst": 20, "initial_concurrency": 4, "max_concurrency": 16},
+}
+
+def throttle_options(environment):
+    """
+    Returns the throttle settings for an environment. The rate limit and maximum concurrency can be overridden using the
+    TERRAIN_{ENVIRONMENT}_RATE_LIMIT and TERRAIN_{ENVIRONMENT}_MAX_CONCURRENCY environment variables. A rate limit of 0
+    disables rate limiting. The program exits with an error message if either variable is invalid.
+    """
+    options = dict(throttle_settings.get(environment, {}))
+    rate_variable = "TERRAIN_{0}_RATE_LIMIT".format(environment.upper())
+    rate = os.environ.get(rate_variable)
+    if rate is not None:
+        try:
+            rate = float(rate)
+        except ValueError:
+            rate = None
+        if rate is None or not math.isfinite(rate) or rate < 0:
+            print("{0} must be a non-negative number of requests per second".format(rate_variable), file=sys.stderr)
+            sys.exit(1)
+        options["rate"] = rate if rate > 0 else None
+        options["burst"] = max(1, int(rate))
+    max_concurrency_variable = "TERRAIN_{0}_MAX_CONCURRENCY".format(environment.upper())
+    max_concurrency = os.environ.get(max_concurrency_variable)
+    if max_concurrency is not None:
+        try:
+            max_concurrency = int(max_concurrency)
+        except ValueError:
+            max_concurrency = None
+        if max_concurrency is None or max_concurrency < 1:
+            print("{0} must be a positive integer".format(max_concurrency_variable), file=sys.stderr)
+            sys.exit(1)
+        options["max_concurrency"] = max_concurrency
+    return options
+
+# The shared throttles for each environment.
+throttles = {}
+throttles_lock = threading.Lock()
+
+def get_throttle(environment):
+    """
+    Returns the throttle shared by every request sent to an environment, creating it if necessary.
+    """
+    with throttles_lock:
+        if environment not in throttles:
+            throttles[environment] = throttle.Throttle(**throttle_options(environment))
+        return throttles[environment]
+
+# Response status codes that indicate that a request may succeed if it's retried.
+retry_status_codes = {429, 500, 502, 503, 504}
+
+# The HTTP methods whose requests can be sent again after any failure. Terrain may already have processed other
+# requests, such as the PUT that subscribes a user to a plan, when their responses are lost or when a gateway gives up
+# waiting for them, so those are only retried when Terrain certainly didn't process them: when the connection couldn't
+# be made, or when Terrain responded with one of the status codes in unprocessed_status_codes.
+idempotent_methods = {"GET", "HEAD", "OPTIONS"}
+unprocessed_status_codes = {429, 503}
+
+# The longest delay requested by a Retry-After header that is honored, in seconds.
+max_retry_after = 60
+
+def is_retryable_status(method, status):
+    """
+    Determines whether or not a request sent using the given method should be retried after a response with the given
+    status code.
+    """
+    if method is None or method.upper() in idempotent_methods:
+        return status in retry_status_codes
+    return status in unprocessed_status_codes
+
+def is_retryable_exception(method, error):
+    """
+    Determines whether or not a request sent using the given method should be retried after it failed without a
+    response. Connection failures, including connection timeouts, are always retried. Other timeouts are only retried
+    for idempotent methods, because Terrain may have processed the request before the response was lost.
+    """
+    import requests
+
+    if isinstance(error, requests.ConnectionError):
+        return True
+    return isinstance(error, requests.Timeout) and (method is None or method.upper() in idempotent_methods)
+
+# Functions that are called after every request sent to Terrain, including retried attempts.
+request_hooks = []
+
+def add_request_hook(hook):
+    """
+    Registers a function to be called after every request sent to Terrain. The function is called with a dictionary
+    containing the environment, method, path, status (None if no response was received), bytes (the size of the
+    response body), start (the time the request was sent, in seconds since the epoch), elapsed (the wall-clock duration
+    of the request in seconds) and error (a description of the failure if no response was received). Hooks may be
+    called from multiple threads at once.
+    """
+    request_hooks.append(hook)
+
+def remove_request_hook(hook):
+    """
+    Unregisters a function registered with add_request_hook.
+    """
+    request_hooks.remove(hook)
+
+def run_request_hooks(environment, method, path, status, size, start, elapsed, error=None):
+    """
+    Calls the registered request hooks for a completed request.
+    """
+    if len(request_hooks) == 0:
+        return
+    event = {
+        "environment": environment,
+        "method": method,
+        "path": path,
+        "status": status,
+        "bytes": size,
+        "start": start,
+        "elapsed": elapsed,
+        "error": error,
+    }
+    for hook in request_hooks:
+        hook(event)
+
+class TerrainClient:
+    """
+    A client for a single Terrain environment. Each client owns a pooled HTTP session so that connections to Terrain are
+    kept alive and reused across calls. Requests that fail with a connection error, a timeout or one of the status codes
+    in retry_status_codes are retried with exponential backoff. Every attempt passes through the environment's shared
+    throttle, which limits the request rate and adapts the number of requests in flight to Terrain's response times.
+    Requests that might have been processed already, such as a PUT whose response timed out, are not retried (see
+    is_retryable_status and is_retryable_exception).
+    """
+
+    def __init__(self, environment, pool_size=10, timeout=(10, 60), retries=3, backoff_factor=0.5):
+        # The requests library is imported here rather than at the top of the module because importing it is slow, and
+        # many invocations of this utility never send a request.
+        import requests
+        import requests.adapters
+
+        self.environment = environment
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def close(self):
+        """
+        Closes the client's pooled connections.
+        """
+        self.session.close()
+
+    def retry_delay(self, attempt, response):
+        """
+        Returns the number of seconds to wait before retrying a failed request. A numeric Retry-After header in the
+        response takes precedence over the exponential backoff delay, up to max_retry_after seconds.
+        """
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after is not None and retry_after.isdigit():
+            return min(int(retry_after), max_retry_after)
+        return self.backoff_factor * (2 ** attempt)
+
+    def request(self, method, path, with_token=True, **kwargs):
+        """
+        Sends a request to Terrain, retrying it if necessary. The access token is added to the request headers, along
+        with any headers passed in the headers keyword argument, unless with_token is False. The response to the final
+        attempt is returned.
+        """
+        import requests
+
+        uri = terrain_uri(self.environment, path)
+        kwargs.setdefault("timeout", self.timeout)
+        extra_headers = kwargs.pop("headers", None) or {}
+        request_throttle = get_throttle(self.environment)
+        attempt = 0
+        while True:
+            headers = dict(extra_headers)
+            if with_token:
+                add_auth_header(self.environment, headers)
+            request_throttle.acquire()
+            start, counter = time.time(), time.perf_counter()
+            try:
+                r = self.session.request(method, uri, headers=headers, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                elapsed = time.perf_counter() - counter
+                request_throttle.release(None, elapsed)
+                run_request_hooks(self.environment, method, path, None, 0, start, elapsed, str(e))
+                if attempt >= self.retries or not is_retryable_exception(method, e):
+                    raise
+                r = None
+            except BaseException:
+                request_throttle.cancel()
+                raise
+            if r is not None:
+                elapsed = time.perf_counter() - counter
+                request_throttle.release(r.status_code, elapsed)
+                size = int(r.headers.get("Content-Length", 0)) if kwargs.get("stream") else len(r.content)
+                run_request_hooks(self.environment, method, path, r.status_code, size, start, elapsed)
+            if r is not None and (not is_retryable_status(method, r.status_code) or attempt >= self.retries):
+                return r
+            delay = self.retry_delay(attempt, r)
+            if r is not None:
+                # Release the connection before waiting; a streamed response would otherwise hold it until it's
+                # garbage collected.
+                r.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def get(self, path, **kwargs):
+        """
+        Sends a GET request to Terrain.
+        """
+        return self.request("GET", path, **kwargs)
+
+    def put(self, path, **kwargs):
+        """
+        Sends a PUT request to Terrain.
+        """
+        return self.request("PUT", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        """
+        Sends a POST request to Terrain.
+        """
+        return self.request("POST", path, **kwargs)
+
+# The shared clients for each environment.
+clients = {}
+clients_lock = threading.Lock()
+
+def configure_client(environment, **options):
+    """
+    Configures the shared client for an environment using the given options. The supported options are the keyword
+    arguments accepted by TerrainClient. The existing client is kept, along with its open connections, if its connection
+    pool is at least as large as requested and its other options match; otherwise it's closed and replaced. This keeps
+    the connections of a long-running session, such as the interactive shell, alive across commands.
+    """
+    with clients_lock:
+        current = clients.get(environment)
+        if current is not None:
+            pool_size = options.get("pool_size", current.pool_size)
+            others = [getattr(current, name) == value for name, value in options.items() if name != "pool_size"]
+            if current.pool_size >= pool_size and all(others):
+                return current
+            current.close()
+        clients[environment] = TerrainClient(environment, **options)
+        return clients[environment]
+
+def get_client(environment):
+    """
+    Returns the shared client for an environment, creating it with the default options if necessary.
+    """
+    with clients_lock:
+        if environment not in clients:
+            clients[environment] = TerrainClient(environment)
+        return clients[environment]
+
+def is_retryable_error(error):
+    """
+    Determines whether or not an exception raised while calling Terrain might go away if the call is made again, using
+    the same rules as TerrainClient: connection failures, timeouts and responses with one of the status codes in
+    retry_status_codes, except that requests that Terrain may already have processed aren't retried.
+    """
+    import requests
+
+    method = getattr(getattr(error, "request", None), "method", None)
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and is_retryable_status(method, error.response.status_code)
+    return is_retryable_exception(method, error)
+
+def is_not_found_error(error):
+    """
+    Determines whether or not an exception raised while calling Terrain indicates that the requested item doesn't exist.
+    """
+    import requests
+
+    return isinstance(error, requests.HTTPError) and error.response is not None and error.response.status_code == 404
+
+def call_with_retries(function, *args, attempts=3, backoff_factor=1.0):
+    """
+    Calls a function that sends one or more requests to Terrain, calling it again with exponential backoff if it fails
+    with a retryable error. Each request made by the function is already retried by TerrainClient; this allows a longer
+    outage to be ridden out when a single item of a bulk operation is being processed. The exception raised by the final
+    attempt is propagated.
+    """
+    attempt = 1
+    while True:
+        try:
+            return function(*args)
+        except Exception as e:
+            if attempt >= attempts or not is_retryable_error(e):
+                raise
+        time.sleep(backoff_factor * (2 ** (attempt - 1)))
+        attempt += 1
+
+# The settings used for the catalog caches.
+cache_settings = {"ttl": 3600, "enabled": True, "refresh": False}
+
+# The catalog caches for each environment.
+catalog_caches = {}
+catalog_caches_lock = threading.Lock()
+
+def configure_cache(ttl=None, enabled=None, refresh=None):
+    """
+    Updates the settings used for the catalog caches. This must be called before any catalog cache is used.
+    """
+    for name, value in [("ttl", ttl), ("enabled", enabled), ("refresh", refresh)]:
+        if value is not None:
+            cache_settings[name] = value
+
+def get_catalog_cache(environment):
+    """
+    Returns the catalog cache for an environment.
+    """
+    with catalog_caches_lock:
+        if environment not in catalog_caches:
+            catalog_caches[environment] = cache.CatalogCache(environment, **cache_settings)
+        return catalog_caches[environment]
+
+@atexit.register
+def flush_catalog_caches():
+    """
+    Writes any changes to the catalog caches to disk.
+    """
+    with catalog_caches_lock:
+        for catalog_cache in catalog_caches.values():
+            catalog_cache.flush()
+
 def get_auth_token(environment, username, password):
     """
     Gets the authentication token for Terrain.
     """
-    uri = terrain_uri(environment, "/token/keycloak")
-    r = requests.get(uri, auth=(username, password))
+    r = get_client(environment).get("/token/keycloak", with_token=False, auth=(username, password))
     if r.status_code == 401:
         print("invalid credentials; please try again")
         return None
@@ -42,22 +387,83 @@ def terrain_auth_file(environment):
     """
     return "{0}/.terrain-{1}".format(os.environ["HOME"], environment)
 
-def get_cached_access_token(environment):
+def terrain_credentials_file():
     """
-    Attempts to obtain the access token from $HOME/.terrain-{environment}.
+    Returns the path to the file containing the credentials used for non-interactive authentication.
+    """
+    return os.environ.get("TERRAIN_CREDENTIALS_FILE", "{0}/.terrain-credentials".format(os.environ["HOME"]))
+
+def get_configured_credentials(environment):
+    """
+    Returns the username and password to use for non-interactive authentication, or None if none are configured. The
+    credentials are taken from the TERRAIN_{ENVIRONMENT}_USERNAME and TERRAIN_{ENVIRONMENT}_PASSWORD environment
+    variables, then the TERRAIN_USERNAME and TERRAIN_PASSWORD environment variables, then the section named after the
+    environment in the credentials file. The credentials file contains passwords, so it's rejected if other users can
+    access it.
+    """
+    for prefix in ["TERRAIN_{0}_".format(environment.upper()), "TERRAIN_"]:
+        username, password = os.environ.get(prefix + "USERNAME"), os.environ.get(prefix + "PASSWORD")
+        if username and password is not None:
+            return username, password
+
+    path = terrain_credentials_file()
+    if not os.path.isfile(path):
+        return None
+    if os.name != "nt" and os.stat(path).st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+        print("the credentials file must not be accessible by other users; run chmod 600", path, file=sys.stderr)
+        sys.exit(1)
+
+    # The credentials file is rarely used, so the parser is imported here.
+    import configparser
+
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.read(path)
+    if not parser.has_section(environment):
+        return None
+    section = parser[environment]
+    if "username" not in section or "password" not in section:
+        print("the", environment, "section of", path, "must contain a username and a password", file=sys.stderr)
+        sys.exit(1)
+    return section["username"], section["password"]
+
+@contextlib.contextmanager
+def token_file_lock(environment):
+    """
+    Holds an exclusive lock on $HOME/.terrain-{environment}.lock while a new access token is obtained and stored, so
+    that concurrent invocations of this utility wait for each other and share the new token rather than all logging in
+    at once. The lock is a separate file because the token file itself is replaced rather than rewritten. Locking is
+    skipped on platforms without fcntl.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    fd = os.open(terrain_auth_file(environment) + ".lock", os.O_RDWR | os.O_CREAT, stat.S_IRUSR | stat.S_IWUSR)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+def get_cached_access_token(environment, margin=0):
+    """
+    Attempts to obtain the access token from $HOME/.terrain-{environment}. The token is ignored if it will expire
+    within margin seconds.
     """
     token = None
     auth_file = terrain_auth_file(environment)
     if os.path.isfile(auth_file):
         with open(auth_file) as f:
-            token = f.readline()
-    return token if jwt.valid(token) else None
+            token = f.readline().strip()
+    return token if jwt.valid(token, margin) else None
 
-def get_username():
+def get_username(environment):
     """
-    Prompts the user for the username to use to authenticate to Terrain.
+    Prompts the user for the username to use to authenticate to Terrain. The environment is included in the prompt
+    because some subcommands log in to more than one.
     """
-    print("Username: ", end="", flush=True)
+    print("Username ({0}): ".format(environment), end="", flush=True)
     return sys.stdin.readline().strip()
 
 def get_password():
@@ -68,23 +474,177 @@ def get_password():
 
 def authenticate(environment):
     """
-    Attempts to obtain an auth token from Terrain.
+    Attempts to obtain an auth token from Terrain by prompting the user to log in. Returns the token along with the
+    credentials that were used to obtain it.
     """
     token = None
     while token is None:
-        username = get_username()
+        username = get_username(environment)
+        if username == "":
+            print("no username provided; unable to authenticate to Terrain", file=sys.stderr)
+            sys.exit(1)
         password = get_password()
         token = get_auth_token(environment, username, password)
-    return token
+    return token, (username, password)
 
 def cache_token(environment, token):
     """
-    Stores a copy of the access token in $HOME/.terrain-{environment}.
+    Stores a copy of the access token in $HOME/.terrain-{environment}. The token is written to a temporary file that
+    only the user can read, which then replaces the token file, so other invocations never read a partially written
+    token. Callers should hold the token file lock.
     """
     auth_file = terrain_auth_file(environment)
-    with open(auth_file, "w") as f:
-        print(token, file=f)
-    os.chmod(auth_file, stat.S_IRUSR | stat.S_IWUSR)
+    tmp_path = "{0}.{1}.tmp".format(auth_file, os.getpid())
+    try:
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, stat.S_IRUSR | stat.S_IWUSR)
+        with os.fdopen(fd, "w") as f:
+            print(token, file=f)
+        os.replace(tmp_path, auth_file)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+class AccessTokenProvider:
+    """
+    Provides the access token for a single Terrain environment. The token is loaded from $HOME/.terrain-{environment},
+    or obtained by prompting the user to log in, and decoded once. The decoded claims are kept in memory so that the
+    token file doesn't have to be read for every request. A new token is only loaded once the current token is within
+    expiration_margin seconds of expiring.
+
+    Terrain doesn't provide a refresh grant, so when the user logs in, the credentials are kept in memory for the rest
+    of the session and used to obtain a new token from /token/keycloak before the current one expires. Credentials that
+    are configured for non-interactive use (see get_configured_credentials) are used the same way, and also in place of
+    the login prompt. The new token is obtained in a background thread once the current token is within
+    refresh_threshold seconds of expiring (or halfway through its lifetime, if that's sooner); other threads keep using
+    the current token in the meantime, so long-running commands never stop to log in again. If the token was loaded from
+    the token file and no credentials are configured, the user is prompted to log in once the token expires.
+
+    New tokens are obtained while holding the token file lock, and the token file is checked again once the lock is
+    held, so concurrent invocations that share the token file share a single new token.
+    """
+
+    def __init__(self, environment, expiration_margin=30, refresh_threshold=300, retry_interval=30):
+        self.environment = environment
+        self.expiration_margin = expiration_margin
+        self.refresh_threshold = refresh_threshold
+        self.retry_interval = retry_interval
+        self.current = (None, None)
+        self.credentials = get_configured_credentials(environment)
+        self.configured = self.credentials is not None
+        self.refresh_at = None
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+
+    def active_token(self):
+        """
+        Returns the current token if it's still active, or None otherwise.
+        """
+        token, claims = self.current
+        return token if token is not None and jwt.valid_payload(claims, self.expiration_margin) else None
+
+    def use_token(self, token):
+        """
+        Makes a token the current token and schedules its replacement if the credentials are available.
+        """
+        claims = jwt.extract_payload(token)
+        self.current = (token, claims)
+        if self.credentials is not None:
+            self.refresh_at = jwt.refresh_time(claims, self.refresh_threshold, self.expiration_margin)
+
+    def due(self, claims):
+        """
+        Determines whether or not it's time to replace the token with the given decoded claims.
+        """
+        refresh_at = jwt.refresh_time(claims, self.refresh_threshold, self.expiration_margin)
+        return refresh_at is not None and time.time() >= refresh_at
+
+    def load(self):
+        """
+        Loads a new access token. The token file is used if it contains an active token. Otherwise, the credentials are
+        used to obtain a new token if they're available, and the user is prompted to log in if they aren't.
+        """
+        token = get_cached_access_token(self.environment, self.expiration_margin)
+        if token is None and self.credentials is not None:
+            with token_file_lock(self.environment):
+                # Another invocation may have stored a new token while this one was waiting for the lock.
+                token = get_cached_access_token(self.environment, self.expiration_margin) or self.reissue()
+            if token is None and self.configured:
+                print("unable to authenticate to Terrain using the configured credentials", file=sys.stderr)
+                sys.exit(1)
+        if token is None:
+            token, self.credentials = authenticate(self.environment)
+            token = token.strip()
+            with token_file_lock(self.environment):
+                cache_token(self.environment, token)
+        self.use_token(token)
+        return token
+
+    def reissue(self):
+        """
+        Obtains a new access token using the credentials and stores it in the token file. Returns None if a new token
+        couldn't be obtained. The caller must hold the token file lock.
+        """
+        try:
+            r = get_client(self.environment).get("/token/keycloak", with_token=False, auth=self.credentials)
+        except Exception:
+            return None
+        if r.status_code < 200 or r.status_code > 299:
+            return None
+        token = r.json()["access_token"].strip()
+        cache_token(self.environment, token)
+        return token
+
+    def refresh(self):
+        """
+        Replaces the current token with a new one ahead of its expiration. This runs in a background thread. If another
+        invocation has already stored a token that isn't due to be replaced yet, that token is used instead. If a new
+        token can't be obtained, another attempt is made after retry_interval seconds.
+        """
+        try:
+            with token_file_lock(self.environment):
+                token = get_cached_access_token(self.environment, self.expiration_margin)
+                if token is None or token == self.current[0] or self.due(jwt.extract_payload(token)):
+                    token = self.reissue()
+            with self.lock:
+                if token is not None:
+                    self.use_token(token)
+                else:
+                    self.refresh_at = time.time() + self.retry_interval
+        finally:
+            self.refresh_lock.release()
+
+    def get_token(self):
+        """
+        Returns an active access token, loading a new one if necessary.
+        """
+        token = self.active_token()
+        if token is not None:
+            refresh_at = self.refresh_at
+            if refresh_at is not None and time.time() >= refresh_at and self.refresh_lock.acquire(blocking=False):
+                threading.Thread(target=self.refresh, daemon=True).start()
+            return token
+        with self.lock:
+            return self.active_token() or self.load()
+
+    def get_claims(self):
+        """
+        Returns the decoded claims of the active access token.
+        """
+        self.get_token()
+        return self.current[1]
+
+# The shared access token providers for each environment.
+token_providers = {}
+token_providers_lock = threading.Lock()
+
+def get_token_provider(environment):
+    """
+    Returns the shared access token provider for an environment.
+    """
+    with token_providers_lock:
+        if environment not in token_providers:
+            token_providers[environment] = AccessTokenProvider(environment)
+        return token_providers[environment]
 
 def get_access_token(environment):
     """
@@ -92,11 +652,13 @@ def get_access_token(environment):
     the file exists and contains an active access token then that token will be used. Otherwise, the user will be
     prompted to log in.
     """
-    token = get_cached_access_token(environment)
-    if token is None:
-        token = authenticate(environment)
-        cache_token(environment, token)
-    return token.strip()
+    return get_token_provider(environment).get_token()
+
+def get_authenticated_username(environment):
+    """
+    Returns the username of the authenticated user.
+    """
+    return get_token_provider(environment).get_claims().get("preferred_username")
 
 def add_auth_header(environment, headers):
     """
@@ -109,8 +671,7 @@ def list_plans(environment):
     """
     Returns the list of available subscription plans.
     """
-    uri = terrain_uri(environment, "/qms/plans")
-    r = requests.get(uri, headers=add_auth_header(environment, {}))
+    r = get_client(environment).get("/qms/plans")
     r.raise_for_status()
     return r.json()["result"]
 
@@ -118,8 +679,7 @@ def list_resource_types(environment):
     """
     Returns the list of available resource types.
     """
-    uri = terrain_uri(environment, "/qms/resource-types")
-    r = requests.get(uri, headers=add_auth_header(environment, {}))
+    r = get_client(environment).get("/qms/resource-types")
     r.raise_for_status()
     return r.json()["result"]
 
@@ -127,8 +687,7 @@ def get_subscription(environment):
     """
     Returns the currently active subscription for the authenticated user.
     """
-    uri = terrain_uri(environment, "/qms/user/plan")
-    r = requests.get(uri, headers=add_auth_header(environment, {}))
+    r = get_client(environment).get("/qms/user/plan")
     r.raise_for_status()
     return r.json()["result"]
 
@@ -136,17 +695,33 @@ def admin_get_subscription(environment, username):
     """
     Returns the currently active subscription for the given user.
     """
-    uri = terrain_uri(environment, "/admin/qms/users/{0}/plan".format(username))
-    r = requests.get(uri, headers=add_auth_header(environment, {}))
+    r = get_client(environment).get("/admin/qms/users/{0}/plan".format(username))
     r.raise_for_status()
     return r.json()["result"]
 
+def admin_get_subscription_if_changed(environment, username, validators=None):
+    """
+    Gets the currently active subscription for the given user unless it hasn't changed since the response that the
+    validators were taken from. The ETag and Last-Modified values from that response, if Terrain provided them, are sent
+    back in If-None-Match and If-Modified-Since headers. Returns a tuple containing the raw response body, or None if
+    Terrain reports that the subscription hasn't changed, and the validators to use for the next request.
+    """
+    headers = {}
+    if validators is not None and validators.get("etag") is not None:
+        headers["If-None-Match"] = validators["etag"]
+    if validators is not None and validators.get("last_modified") is not None:
+        headers["If-Modified-Since"] = validators["last_modified"]
+    r = get_client(environment).get("/admin/qms/users/{0}/plan".format(username), headers=headers)
+    if r.status_code == 304:
+        return None, validators
+    r.raise_for_status()
+    return r.content, {"etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified")}
+
 def admin_add_subscription(environment, username, plan):
     """
     Subscribes a user to a plan.
     """
-    uri = terrain_uri(environment, "/admin/qms/users/{0}/plan/{1}".format(username, plan))
-    r = requests.put(uri, headers=add_auth_header(environment, {}))
+    r = get_client(environment).put("/admin/qms/users/{0}/plan/{1}".format(username, plan))
     r.raise_for_status()
     return r.json()
 
@@ -154,41 +729,206 @@ def admin_set_quota(environment, username, resource_type, quota):
     """
     Sets the quota associated with a resuource type in the user's current subscription.
     """
-    uri = terrain_uri(environment, "/admin/qms/users/{0}/plan/{1}/quota".format(username, resource_type))
+    path = "/admin/qms/users/{0}/plan/{1}/quota".format(username, resource_type)
     payload = {"quota": quota}
-    r = requests.post(uri, headers=add_auth_header(environment, {}), json=payload)
+    r = get_client(environment).post(path, json=payload)
     r.raise_for_status()
     return r.json()["result"]
 
+def iter_json_array(chunks, key):
+    """
+    Incrementally parses a JSON object from an iterable of byte strings, yielding the elements of the array stored under
+    the given key as soon as each one has been received. The array must be the value of the first occurrence of the key
+    in the document. Nothing after the end of the array is parsed.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buffer = ""
+    pos = None
+    key_pattern = re.compile(r'"{0}"\s*:\s*\['.format(re.escape(key)))
+    while True:
+        # Find the start of the array if it hasn't been found yet.
+        if pos is None:
+            m = key_pattern.search(buffer)
+            if m is not None:
+                buffer, pos = buffer[m.end():], 0
+
+        # Parse as many complete elements as possible, discarding each one from the buffer once it's been parsed.
+        while pos is not None:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == "]":
+                return
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break
+            if end == len(buffer) and buffer[end - 1] not in '"]}':
+                # A number or literal at the end of the buffer may continue in the next chunk.
+                break
+            yield element
+            buffer, pos = buffer[end:], 0
+
+        # Read the next chunk.
+        chunk = next(chunks, None)
+        if chunk is None:
+            raise ValueError("incomplete JSON document: the {0} array is missing or truncated".format(key))
+        buffer += text_decoder.decode(chunk)
+
+class SubjectValidator:
+    """
+    Determines whether or not usernames are valid for a single Terrain environment. Each username is resolved with a
+    single /subjects search, and the response is parsed as it's streamed so that the search stops soon after an exact
+    match is found. Any other pending usernames that appear in the parsed search results are resolved by the same
+    search. Concurrent callers asking about the same username share one search, and usernames that are known to be
+    valid are taken from the catalog cache without sending a request at all.
+    """
+
+    # The maximum number of bytes to read after an exact match is found. Reading the rest of a short response allows
+    # its connection to be reused and may resolve other pending usernames; longer responses are abandoned instead.
+    drain_limit = 65536
+
+    def __init__(self, environment):
+        self.environment = environment
+        self.lock = threading.Lock()
+        self.pending = {}
+
+    def resolve(self, username, valid):
+        """
+        Records the result of validating a pending username.
+        """
+        with self.lock:
+            future = self.pending.pop(username, None)
+        if future is not None:
+            if valid:
+                get_catalog_cache(self.environment).add_subject(username)
+            future.set_result(valid)
+
+    def search(self, username):
+        """
+        Searches for a pending username, resolving it and any other pending usernames in the search results. If the
+        search fails, the exception is passed on to everyone waiting for the username.
+        """
+        if username not in self.pending:
+            return
+        try:
+            self.stream_search(username)
+        except Exception as e:
+            with self.lock:
+                future = self.pending.pop(username, None)
+            if future is not None:
+                future.set_exception(e)
+
+    def stream_search(self, username):
+        """
+        Sends a /subjects search for a username and parses the results as they arrive.
+        """
+        r = get_client(self.environment).get("/subjects", params={"search": username}, stream=True)
+        with r:
+            r.raise_for_status()
+            received = [0]
+            limit = [None]
+            def counted_chunks():
+                for chunk in r.iter_content(chunk_size=8192):
+                    received[0] += len(chunk)
+                    yield chunk
+                    if limit[0] is not None and received[0] > limit[0]:
+                        return
+            chunks = counted_chunks()
+            subjects = iter_json_array(chunks, "subjects")
+            for subject in subjects:
+                if subject["id"] in self.pending:
+                    self.resolve(subject["id"], True)
+                if subject["id"] == username:
+                    break
+            else:
+                self.resolve(username, False)
+                return
+
+            # Read the rest of a short response so that the connection can be reused, resolving any other pending
+            # usernames that appear in it along the way. The chunks stop once the limit is reached, even in the middle
+            # of an element, which leaves the rest of the array incomplete.
+            limit[0] = received[0] + self.drain_limit
+            try:
+                for subject in subjects:
+                    if subject["id"] in self.pending:
+                        self.resolve(subject["id"], True)
+            except ValueError:
+                return
+            for chunk in chunks:
+                pass
+
+    def validate(self, usernames, concurrency=8):
+        """
+        Validates a list of usernames. Returns a dictionary mapping each distinct username to True if the username is
+        valid or False otherwise. Up to concurrency searches are sent at the same time.
+        """
+        catalog_cache = get_catalog_cache(self.environment)
+        futures = {}
+        searches = []
+        with self.lock:
+            for username in dict.fromkeys(usernames):
+                if catalog_cache.has_subject(username):
+                    continue
+                if username not in self.pending:
+                    self.pending[username] = concurrent.futures.Future()
+                    searches.append(username)
+                futures[username] = self.pending[username]
+
+        if len(searches) == 1:
+            self.search(searches[0])
+        elif len(searches) > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(concurrency, len(searches))) as executor:
+                list(executor.map(self.search, searches))
+
+        return {username: futures[username].result() if username in futures else True
+                for username in dict.fromkeys(usernames)}
+
+# The shared username validators for each environment.
+subject_validators = {}
+subject_validators_lock = threading.Lock()
+
+def validate_usernames(environment, usernames, concurrency=8):
+    """
+    Determines which of the provided usernames are valid. Returns a dictionary mapping each distinct username to True
+    if it's valid or False otherwise. Duplicate usernames are only looked up once, usernames that are known to be valid
+    are taken from the catalog cache, and the remaining usernames are resolved with as few requests as possible.
+    """
+    with subject_validators_lock:
+        if environment not in subject_validators:
+            subject_validators[environment] = SubjectValidator(environment)
+        validator = subject_validators[environment]
+    return validator.validate(usernames, concurrency)
+
 def is_valid_username(environment, username):
     """
     Determines whether or not the provided username is valid.
     """
-    uri = terrain_uri(environment, "/subjects")
-    payload = {"search": username}
-    r = requests.get(uri, headers=add_auth_header(environment, {}), params=payload)
-    r.raise_for_status()
-    for subject in r.json()["subjects"]:
-        if subject["id"] == username:
-            return True
-    return False
+    return validate_usernames(environment, [username])[username]
+
+def plan_index(environment):
+    """
+    Returns a dictionary mapping lower-case plan names to plans, using the catalog cache if possible.
+    """
+    return get_catalog_cache(environment).index("plans", lambda: list_plans(environment))
+
+def resource_type_index(environment):
+    """
+    Returns a dictionary mapping lower-case resource type names to resource types, using the catalog cache if possible.
+    """
+    return get_catalog_cache(environment).index("resource_types", lambda: list_resource_types(environment))
 
 def validate_plan_name(environment, plan_name):
     """
     Determines whether or not the provided plan name is valid.
     """
-    plans = list_plans(environment)
-    for plan in plans:
-        if plan["name"].lower() == plan_name.lower():
-            return plan["name"]
-    return None
+    plan = plan_index(environment).get(plan_name.lower())
+    return plan["name"] if plan is not None else None
 
 def validate_resource_type_name(environment, resource_type_name):
     """
     Determines whether or not the provided resource type name is valid.
     """
-    resource_types = list_resource_types(environment)
-    for resource_type in resource_types:
-        if resource_type["name"].lower() == resource_type_name.lower():
-            return resource_type["name"]
-    return None
+    resource_type = resource_type_index(environment).get(resource_type_name.lower())
+    return resource_type["name"] if resource_type is not None else None
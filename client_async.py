@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+import aiohttp
+import asyncio
+import client
+import json
+import time
+
+class AsyncTerrainClient:
+    """
+    An asyncio-based client for a single Terrain environment, intended for fanning out read requests across many users.
+    All requests share one connection pool so that connections are reused, and a semaphore limits the number of requests
+    that are in flight at any one time. Requests also pass through the environment's shared throttle (see
+    client.get_throttle), which may hold the number of requests in flight below that limit. Each request is subject to
+    its own timeout, and requests that fail with one of the status codes in client.retry_status_codes are retried with
+    exponential backoff.
+
+    Instances must be used as async context managers:
+
+        async with AsyncTerrainClient("prod", concurrency=32) as terrain:
+            subscription = await terrain.admin_get_subscription("ipcdev")
+    """
+
+    def __init__(self, environment, concurrency=16, timeout=60, retries=3, backoff_factor=0.5):
+        self.environment = environment
+        self.concurrency = concurrency
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.semaphore = None
+        self.session = None
+
+    async def __aenter__(self):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.concurrency))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def request(self, method, path, **kwargs):
+        """
+        Sends a request to Terrain and returns the decoded JSON response body. An aiohttp.ClientResponseError is raised
+        if the final attempt fails.
+        """
+        uri = client.terrain_uri(self.environment, path)
+        request_throttle = client.get_throttle(self.environment)
+        attempt = 0
+        async with self.semaphore:
+            while True:
+                headers = client.add_auth_header(self.environment, {})
+                await request_throttle.acquire_async()
+                start, counter = time.time(), time.perf_counter()
+                try:
+                    async with self.session.request(method, uri, headers=headers, timeout=self.timeout, **kwargs) as r:
+                        body = await r.read()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    elapsed = time.perf_counter() - counter
+                    request_throttle.release(None, elapsed)
+                    client.run_request_hooks(self.environment, method, path, None, 0, start, elapsed, repr(e))
+                    raise
+                except BaseException:
+                    request_throttle.cancel()
+                    raise
+                elapsed = time.perf_counter() - counter
+                request_throttle.release(r.status, elapsed)
+                client.run_request_hooks(self.environment, method, path, r.status, len(body), start, elapsed)
+                if r.status not in client.retry_status_codes or attempt >= self.retries:
+                    r.raise_for_status()
+                    return json.loads(body)
+                await asyncio.sleep(self.backoff_factor * (2 ** attempt))
+                attempt += 1
+
+    async def list_plans(self):
+        """
+        Returns the list of available subscription plans.
+        """
+        return (await self.request("GET", "/qms/plans"))["result"]
+
+    async def list_resource_types(self):
+        """
+        Returns the list of available resource types.
+        """
+        return (await self.request("GET", "/qms/resource-types"))["result"]
+
+    async def admin_get_subscription(self, username):
+        """
+        Returns the currently active subscription for the given user.
+        """
+        return (await self.request("GET", "/admin/qms/users/{0}/plan".format(username)))["result"]
+
+    async def admin_get_subscriptions(self, usernames):
+        """
+        Gets the currently active subscriptions for each user in an iterable of usernames. This is an async generator
+        that yields a tuple containing the username, the subscription and the exception raised if the subscription
+        couldn't be obtained, in the order in which the responses arrive. The usernames are consumed lazily, so the
+        iterable may be arbitrarily long.
+        """
+        usernames = iter(usernames)
+        results = asyncio.Queue(maxsize=self.concurrency)
+
+        async def worker():
+            try:
+                for username in usernames:
+                    try:
+                        result = (username, await self.admin_get_subscription(username), None)
+                    except Exception as e:
+                        result = (username, None, e)
+                    await results.put(result)
+            finally:
+                # Always signal that the worker has stopped, so that the consumer never waits for a worker that died.
+                await results.put(None)
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            remaining = len(workers)
+            while remaining > 0:
+                result = await results.get()
+                if result is None:
+                    remaining -= 1
+                else:
+                    yield result
+
+            # Raise any error that stopped a worker, such as a failure to read the usernames.
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
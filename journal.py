@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+import json
+import os.path
+import threading
+import time
+
+class Journal:
+    """
+    An append-only record of the items processed by a bulk operation, stored as JSON lines. Each line records the key
+    identifying an item and the outcome of processing it. When a bulk operation is resumed, the journal is read back so
+    that items that were already completed can be skipped, while items that failed are attempted again. Appending one
+    line per item means that an interrupted run loses at most the item that was being written.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.lock = threading.Lock()
+        self.statuses = {}
+        complete = True
+        if resume and os.path.isfile(path):
+            complete = self.load()
+        self.file = open(path, "a" if resume else "w")
+        if not complete:
+            # End the partially written line so that the next entry isn't appended to it and lost along with it.
+            self.file.write("\n")
+            self.file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def load(self):
+        """
+        Reads the existing journal entries. The most recent entry for each key wins. A partially written final line,
+        which can be left behind if the process was killed, is ignored, as is any other line that isn't a journal entry.
+        Returns False if the journal ends with a partially written line.
+        """
+        line = ""
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(entry, dict) and "key" in entry:
+                    self.statuses[entry["key"]] = entry.get("status")
+        return line == "" or line.endswith("\n")
+
+    def is_done(self, key):
+        """
+        Determines whether or not an item was completed successfully in an earlier run.
+        """
+        return self.statuses.get(key) == "done"
+
+    def record(self, key, status, message=None):
+        """
+        Appends the outcome of processing an item to the journal. The status should be "done" for items that don't need
+        to be processed again.
+        """
+        entry = {"key": key, "status": status, "message": message, "time": time.time()}
+        with self.lock:
+            self.statuses[key] = status
+            self.file.write(json.dumps(entry) + "\n")
+            self.file.flush()
+
+    def close(self):
+        """
+        Closes the journal file.
+        """
+        self.file.close()
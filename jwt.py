@@ -3,37 +3,48 @@
 import base64
 import datetime
 import json
-import pprint
 
 def extract_payload(token):
     """
     Extracts the payload from a JWT.
     """
     payload = token.split(".", 3)[1] + '==' if token is not None else ""
-    return json.loads(base64.b64decode(payload)) if payload != "" else None
+    return json.loads(base64.urlsafe_b64decode(payload)) if payload != "" else None
 
-def get_username(token):
+def valid_payload(payload, margin=0):
     """
-    Returns the username of the authenticated user.
+    Determines whether or not a decoded JWT payload appears to be valid. The payload is considered to be valid if the
+    current time is between its not-before and expiration timestamps. If a margin is specified, the payload is treated
+    as though it expires that many seconds early.
     """
-    if token is None or token == "":
+    if payload is None:
+        return False
+    current_time = datetime.datetime.now().timestamp()
+    if "nbf" in payload and payload["nbf"] > current_time:
+        return False
+    if "exp" in payload and payload["exp"] - margin < current_time:
+        return False
+    return True
+
+def refresh_time(payload, threshold, margin=0):
+    """
+    Returns the time, in seconds since the epoch, after which a new token should be obtained to replace the token with
+    a decoded payload. This is threshold seconds before the token expires, or halfway through the token's lifetime if
+    the lifetime is shorter than twice the threshold. If a margin is specified, the payload is treated as though it
+    expires that many seconds early. Tokens without an issued-at timestamp are assumed to have just been issued.
+    Returns None if the payload has no expiration timestamp.
+    """
+    if payload is None or "exp" not in payload:
         return None
-    payload = extract_payload(token)
-    return payload["preferred_username"] if "preferred_username" in payload else None
+    issued = payload.get("iat", datetime.datetime.now().timestamp())
+    expires = payload["exp"] - margin
+    return expires - max(0, min(threshold, (expires - issued) / 2))
 
-def valid(token):
+def valid(token, margin=0):
     """
     Determines whether or not a JWT appears to be valid. For the time being, a JWT is considered to be valid if the
     current time is between the JWT's not-before and expiration timestamps.
     """
     if token is None or token == "":
         return False
-    payload = extract_payload(token)
-    current_time = datetime.datetime.now()
-    nbf = datetime.datetime.fromtimestamp(payload["nbf"]) if "nbf" in payload else None
-    if nbf is not None and nbf > current_time:
-        return False
-    exp = datetime.datetime.fromtimestamp(payload["exp"]) if "exp" in payload else None
-    if exp is not None and exp < current_time:
-        return False
-    return True
+    return valid_payload(extract_payload(token), margin)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+import fractions
+import functools
+import re
+
+# The units accepted for each kind of resource type, mapped to the number of base units they represent. Data sizes are
+# measured in bytes: single-letter and IEC suffixes are binary, while SI suffixes are decimal. Processing time is
+# measured in hours. Resource types with any other unit only accept the original binary multipliers.
+units = {
+    "bytes": {
+        "": 1, "b": 1,
+        "k": 2**10, "kib": 2**10, "kb": 10**3,
+        "m": 2**20, "mib": 2**20, "mb": 10**6,
+        "g": 2**30, "gib": 2**30, "gb": 10**9,
+        "t": 2**40, "tib": 2**40, "tb": 10**12,
+        "p": 2**50, "pib": 2**50, "pb": 10**15,
+    },
+    "hours": {
+        "": 1,
+        "s": fractions.Fraction(1, 3600), "sec": fractions.Fraction(1, 3600), "secs": fractions.Fraction(1, 3600),
+        "second": fractions.Fraction(1, 3600), "seconds": fractions.Fraction(1, 3600),
+        "m": fractions.Fraction(1, 60), "min": fractions.Fraction(1, 60), "mins": fractions.Fraction(1, 60),
+        "minute": fractions.Fraction(1, 60), "minutes": fractions.Fraction(1, 60),
+        "h": 1, "hr": 1, "hrs": 1, "hour": 1, "hours": 1,
+        "d": 24, "day": 24, "days": 24,
+        "w": 168, "week": 168, "weeks": 168,
+    },
+    None: {"": 1, "k": 2**10, "m": 2**20, "g": 2**30, "t": 2**40},
+}
+
+# The grammar for quota expressions. An expression is either an absolute amount, such as 10G; a change relative to the
+# current quota, such as +10% or -1T; or the current quota or usage combined with an amount, such as usage*2 or
+# quota+5G. Amounts are decimal numbers followed by an optional unit.
+expression_pattern = re.compile(r"""
+    ^\s*(?:
+        (?P<base>quota|usage)\s*(?:(?P<base_op>[-+*/])\s*(?P<base_amount>\d+(?:\.\d+)?)\s*(?P<base_unit>%|[a-z]*))?
+        |
+        (?P<sign>[-+])?\s*(?P<amount>\d+(?:\.\d+)?)\s*(?P<unit>%|[a-z]*)
+    )\s*$
+""", re.VERBOSE | re.IGNORECASE)
+
+def dimension(unit):
+    """
+    Returns the kind of quantity measured by a resource type, based on the unit listed for it by Terrain: bytes, hours
+    or None if the unit isn't recognized.
+    """
+    unit = (unit or "").lower()
+    if "byte" in unit:
+        return "bytes"
+    if "hour" in unit:
+        return "hours"
+    return None
+
+class QuotaExpression:
+    """
+    A compiled quota expression. Absolute expressions can be evaluated on their own; relative expressions need the
+    user's current quota or usage for the resource type. All arithmetic is exact.
+    """
+
+    def __init__(self, spec, base, op, amount, percent):
+        self.spec = spec
+        self.base = base
+        self.op = op
+        self.amount = amount
+        self.percent = percent
+
+    @property
+    def relative(self):
+        """
+        True if the expression depends on the current quota or usage.
+        """
+        return self.base is not None
+
+    def evaluate(self, quota=None, usage=None):
+        """
+        Evaluates the expression, returning the new quota as a Fraction. A ValueError is raised if the expression is
+        relative and the value it depends on isn't available, or if the result is negative.
+        """
+        if self.base is None:
+            return self.amount
+        current = {"quota": quota, "usage": usage}[self.base]
+        if current is None:
+            raise ValueError("{0}: the user has no current {1} for this resource type".format(self.spec, self.base))
+        current = fractions.Fraction(str(current))
+        amount = current * self.amount / 100 if self.percent else self.amount
+        if self.op is None:
+            result = current
+        elif self.op == "+":
+            result = current + amount
+        elif self.op == "-":
+            result = current - amount
+        elif self.op == "*":
+            result = current * amount
+        else:
+            result = current / amount
+        if result < 0:
+            raise ValueError("{0}: the resulting quota would be negative".format(self.spec))
+        return result
+
+def parse_amount(spec, number, unit, kind):
+    """
+    Converts a decimal number and a unit to an exact number of base units.
+    """
+    multiplier = units[kind].get(unit.lower())
+    if multiplier is None:
+        allowed = ", ".join(u for u in units[kind] if u != "")
+        raise ValueError("{0}: unknown unit '{1}'; expected one of: {2}".format(spec, unit, allowed))
+    return fractions.Fraction(number) * multiplier
+
+@functools.lru_cache(maxsize=4096)
+def compile_quota(spec, kind=None):
+    """
+    Compiles a quota specification for a kind of resource type (see dimension). Compiled expressions are cached, so
+    converting the same specification many times, as is common in large manifests and policy files, only parses it
+    once. A ValueError describing the problem is raised if the specification is invalid.
+    """
+    m = expression_pattern.match(spec)
+    if m is None:
+        raise ValueError("{0}: not a valid quota expression".format(spec))
+
+    if m.group("base") is not None:
+        base, op = m.group("base").lower(), m.group("base_op")
+        if op is None:
+            return QuotaExpression(spec, base, None, None, False)
+        unit = m.group("base_unit")
+        if unit == "%" and op in "*/":
+            raise ValueError("{0}: percentages can only be added or subtracted".format(spec))
+        if unit != "" and unit != "%" and op in "*/":
+            raise ValueError("{0}: multipliers and divisors can't have units".format(spec))
+        if unit == "%":
+            return QuotaExpression(spec, base, op, fractions.Fraction(m.group("base_amount")), True)
+        amount = parse_amount(spec, m.group("base_amount"), unit, kind)
+        if op == "/" and amount == 0:
+            raise ValueError("{0}: division by zero".format(spec))
+        return QuotaExpression(spec, base, op, amount, False)
+
+    sign, unit = m.group("sign"), m.group("unit")
+    if unit == "%":
+        if sign is None:
+            raise ValueError("{0}: percentages must be relative, for example +10%".format(spec))
+        return QuotaExpression(spec, "quota", sign, fractions.Fraction(m.group("amount")), True)
+    amount = parse_amount(spec, m.group("amount"), unit, kind)
+    if sign is not None:
+        return QuotaExpression(spec, "quota", sign, amount, False)
+    return QuotaExpression(spec, None, None, amount, False)
+
+def to_raw_quota(value, kind=None):
+    """
+    Converts an exact quota to the value sent to Terrain. Byte quotas are rounded down to whole bytes; other quotas are
+    integers when they're whole numbers and floats otherwise.
+    """
+    if kind == "bytes" or value.denominator == 1:
+        return int(value)
+    return float(value)
+
+def convert(spec, unit=None, quota=None, usage=None):
+    """
+    Converts a quota specification to a raw quota for a resource type with the given unit. The user's current quota and
+    usage are needed for relative expressions. A ValueError is raised if the specification is invalid.
+    """
+    kind = dimension(unit)
+    return to_raw_quota(compile_quota(str(spec).strip(), kind).evaluate(quota, usage), kind)
+
+def convert_column(specs, unit=None):
+    """
+    Converts a column of absolute quota specifications for a single resource type in one pass. Each distinct
+    specification is compiled and evaluated once, no matter how many times it appears. Returns a list containing a
+    tuple of the raw quota and an error message (one of which is None) for each specification.
+    """
+    kind = dimension(unit)
+    results = {}
+    converted = []
+    for spec in specs:
+        spec = str(spec).strip()
+        if spec not in results:
+            try:
+                expression = compile_quota(spec, kind)
+                if expression.relative:
+                    raise ValueError("{0}: relative quotas aren't allowed here".format(spec))
+                results[spec] = (to_raw_quota(expression.evaluate(), kind), None)
+            except ValueError as e:
+                results[spec] = (None, str(e))
+        converted.append(results[spec])
+    return converted
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+import csv
+import json
+import math
+import sys
+import textwrap
+
+# The registered kinds of records, keyed by name. Each kind has a table formatter, a list of CSV columns and a function
+# that converts a record to CSV rows.
+record_kinds = {}
+
+def register_record_kind(kind, format_table, csv_columns, csv_rows):
+    """
+    Registers a kind of record that can be rendered. The format_table function returns the lines of text used to
+    display a record to a person. The csv_rows function returns a list of CSV rows for a record, where each row is a
+    list of values in the same order as csv_columns.
+    """
+    record_kinds[kind] = {"table": format_table, "csv_columns": csv_columns, "csv_rows": csv_rows}
+
+def json_safe(value):
+    """
+    Prepares a value for JSON encoding. Infinite and NaN values, which can't be represented in JSON, become None.
+    """
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, dict):
+        return {k: json_safe(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_safe(v) for v in value]
+    return value
+
+class Renderer:
+    """
+    The base class for output renderers. Records are rendered one at a time as they become available, so renderers
+    must not need to see every record before producing output. Renderers are context managers; the renderer is closed
+    when the context exits.
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream if stream is not None else sys.stdout
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def render(self, kind, record, error=False):
+        """
+        Renders a single record. The error flag indicates that the record describes a failure.
+        """
+        raise NotImplementedError
+
+    def message(self, text):
+        """
+        Displays an informational message that isn't part of the rendered data. Messages go to standard error so that
+        machine-readable output isn't disrupted.
+        """
+        print(text, file=sys.stderr, flush=True)
+
+    def close(self):
+        """
+        Finishes rendering.
+        """
+        pass
+
+class TableRenderer(Renderer):
+    """
+    Renders records as human-readable text. Records that describe failures are displayed on standard error.
+    """
+
+    def render(self, kind, record, error=False):
+        lines = record_kinds[kind]["table"](record)
+        print("\n".join(lines), file=sys.stderr if error else self.stream, flush=True)
+
+    def message(self, text):
+        print(text, file=self.stream, flush=True)
+
+class JsonRenderer(Renderer):
+    """
+    Renders records as a single JSON array. Each record is written as soon as it's rendered.
+    """
+
+    def __init__(self, stream=None):
+        super().__init__(stream)
+        self.count = 0
+
+    def render(self, kind, record, error=False):
+        prefix = "[\n" if self.count == 0 else ",\n"
+        self.stream.write(prefix + textwrap.indent(json.dumps(json_safe(record), indent=2), "  "))
+        self.stream.flush()
+        self.count += 1
+
+    def close(self):
+        self.stream.write("[]\n" if self.count == 0 else "\n]\n")
+        self.stream.flush()
+
+class NdjsonRenderer(Renderer):
+    """
+    Renders records as newline-delimited JSON, with one record per line.
+    """
+
+    def render(self, kind, record, error=False):
+        self.stream.write(json.dumps(json_safe(record)) + "\n")
+        self.stream.flush()
+
+class CsvRenderer(Renderer):
+    """
+    Renders records as CSV. A header row is written before the first record of each kind.
+    """
+
+    def __init__(self, stream=None):
+        super().__init__(stream)
+        self.writer = csv.writer(self.stream)
+        self.kinds = set()
+
+    def render(self, kind, record, error=False):
+        if kind not in self.kinds:
+            self.kinds.add(kind)
+            self.writer.writerow(record_kinds[kind]["csv_columns"])
+        self.writer.writerows(record_kinds[kind]["csv_rows"](record))
+        self.stream.flush()
+
+# The available renderers, keyed by output format name.
+renderers = {
+    "table": TableRenderer,
+    "json": JsonRenderer,
+    "ndjson": NdjsonRenderer,
+    "csv": CsvRenderer,
+}
+
+def register_renderer(output_format, renderer_class):
+    """
+    Registers a renderer for an output format.
+    """
+    renderers[output_format] = renderer_class
+
+def output_formats():
+    """
+    Returns the names of the available output formats.
+    """
+    return list(renderers.keys())
+
+def get_renderer(output_format, stream=None):
+    """
+    Creates a renderer for an output format.
+    """
+    return renderers[output_format](stream)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+import argparse
+import client
+import os
+import renderers
+import shlex
+import subcommands
+import sys
+
+try:
+    import readline
+except ImportError:
+    readline = None
+
+# The commands that end the shell session.
+exit_commands = ["exit", "quit"]
+
+# The options whose values can be completed, mapped to the type of value that each option accepts.
+completion_options = {
+    "-u": "user",
+    "--user": "user",
+    "-p": "plan",
+    "--plan": "plan",
+    "-r": "resource_type",
+    "--resource-type": "resource_type",
+}
+
+def subparser_choices(parser):
+    """
+    Returns the names of the subcommands accepted by an argument parser.
+    """
+    for action in parser._actions:
+        if isinstance(action, argparse._SubParsersAction):
+            return list(action.choices.keys())
+    return []
+
+class Shell:
+    """
+    An interactive shell that runs subcommands without restarting the process. The argument parsers for the subcommand
+    modules are configured once, and the access token, the connection pool and the catalogs of plans and resource types
+    are kept in memory for the duration of the session.
+    """
+
+    def __init__(self, args):
+        self.env = args.env
+        self.session = {
+            k: v for k, v in vars(args).items() if k not in ["func", "command", "env", "envs", "traces_commands"]
+        }
+        self.parser = argparse.ArgumentParser(prog="terrain", add_help=False)
+        self.parser.add_argument("-e", "--env", action="append")
+        self.parser.add_argument("-o", "--output", choices=renderers.output_formats())
+        self.module_subcommands = {}
+        subparsers = self.parser.add_subparsers(metavar="subcommand", dest="command")
+        for entry in subcommands.registered_modules():
+            if entry["module"] == __name__:
+                continue
+            names = [entry["subcommand"]] + entry["aliases"]
+            parser = subparsers.add_parser(names[0], aliases=names[1:], description=entry["description"])
+            subcommands.load_subcommand_module(entry).config_argument_parser(parser)
+            for name in names:
+                self.module_subcommands[name] = subparser_choices(parser)
+        subcommands.add_subcommand_subparser(subparsers)
+
+    def run_command(self, line):
+        """
+        Parses and runs a single command line. Errors are displayed rather than ending the session.
+        """
+        try:
+            words = shlex.split(line)
+        except ValueError as e:
+            print("invalid command: {0}".format(e), file=sys.stderr)
+            return
+        if len(words) == 0:
+            return
+        try:
+            args = self.parser.parse_args(words, namespace=argparse.Namespace(**self.session))
+            if not hasattr(args, "func"):
+                print("a subcommand is required; use help to list the available subcommands", file=sys.stderr)
+                return
+            subcommands.select_environments(self.parser, args, self.env)
+            self.run_traced(args)
+        except SystemExit:
+            pass
+        except KeyboardInterrupt:
+            # Interrupting a long-running command returns to the prompt rather than ending the session.
+            print("interrupted", file=sys.stderr)
+        except Exception as e:
+            print("error: {0}".format(e), file=sys.stderr)
+        finally:
+            client.flush_catalog_caches()
+
+    def run_traced(self, args):
+        """
+        Runs a subcommand. If tracing was requested when the shell was started, the requests sent by the subcommand are
+        reported when it completes, and the timeline file is replaced with the subcommand's timeline.
+        """
+        if not args.trace and args.trace_file is None:
+            args.func(args)
+            return
+
+        # The timing module is only needed when tracing is requested, so it's imported here.
+        import timing
+
+        tracer = timing.Tracer()
+        tracer.install()
+        try:
+            args.func(args)
+        finally:
+            tracer.uninstall()
+            tracer.report(args.trace, args.trace_file)
+
+    def value_completions(self, value_type):
+        """
+        Returns the possible values for an option. Failures to fetch the catalogs are ignored.
+        """
+        try:
+            if value_type == "plan":
+                return [plan["name"] for plan in client.plan_index(self.env).values()]
+            if value_type == "resource_type":
+                return [rt["name"] for rt in client.resource_type_index(self.env).values()]
+            if value_type == "user":
+                return client.get_catalog_cache(self.env).subjects()
+        except Exception:
+            pass
+        return []
+
+    def completions(self, words):
+        """
+        Returns the possible completions for the next word on a command line.
+        """
+        if len(words) == 0:
+            return list(self.module_subcommands.keys()) + ["help"] + exit_commands
+        if len(words) == 1:
+            return self.module_subcommands.get(words[0], [])
+        if words[-1] in completion_options:
+            return self.value_completions(completion_options[words[-1]])
+        return []
+
+    def complete(self, text, state):
+        """
+        The readline completion function.
+        """
+        line = readline.get_line_buffer()[:readline.get_begidx()]
+        try:
+            words = shlex.split(line)
+        except ValueError:
+            words = line.split()
+        matches = [c for c in self.completions(words) if c.startswith(text)]
+        return matches[state] if state < len(matches) else None
+
+    def run(self):
+        """
+        Runs commands until the user exits the shell.
+        """
+        history_file = "{0}/.terrain_history".format(os.environ["HOME"])
+        if readline is not None:
+            readline.set_completer(self.complete)
+            readline.set_completer_delims(" \t\n")
+            readline.parse_and_bind("tab: complete")
+            if os.path.isfile(history_file):
+                readline.read_history_file(history_file)
+
+        # Authenticate once at the start of the session.
+        client.get_access_token(self.env)
+
+        prompt = "terrain ({0})> ".format(self.env)
+        try:
+            while True:
+                try:
+                    line = input(prompt)
+                except KeyboardInterrupt:
+                    print()
+                    continue
+                except EOFError:
+                    print()
+                    break
+                if line.strip() in exit_commands:
+                    break
+                self.run_command(line)
+        finally:
+            if readline is not None:
+                try:
+                    readline.write_history_file(history_file)
+                except OSError:
+                    pass
+
+def run_shell(args):
+    """
+    Starts an interactive shell.
+    """
+    Shell(args).run()
+
+def config_argument_parser(parser):
+    """
+    Configures the argument parser for the module.
+    """
+    parser.set_defaults(func=run_shell, traces_commands=True)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import os.path
+import sqlite3
+import stat
+import time
+
+# The statements used to create the snapshot tables. The full subscription is stored as JSON so that it can be displayed
+# exactly as Terrain returned it, and the plan name, quotas and usages are also stored in indexed columns so that the
+# snapshot can be filtered by plan or resource type without decoding every subscription.
+schema = [
+    """
+    CREATE TABLE IF NOT EXISTS subscriptions (
+        username TEXT PRIMARY KEY,
+        plan TEXT COLLATE NOCASE,
+        fetched REAL NOT NULL,
+        subscription TEXT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS subscriptions_plan ON subscriptions (plan)",
+    "CREATE INDEX IF NOT EXISTS subscriptions_fetched ON subscriptions (fetched)",
+    """
+    CREATE TABLE IF NOT EXISTS usages (
+        username TEXT NOT NULL REFERENCES subscriptions (username) ON DELETE CASCADE,
+        resource_type TEXT NOT NULL COLLATE NOCASE,
+        quota REAL,
+        usage REAL,
+        PRIMARY KEY (username, resource_type)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS usages_resource_type ON usages (resource_type)",
+]
+
+def default_path(environment):
+    """
+    Returns the default path to the snapshot file for an environment.
+    """
+    return "{0}/.terrain-snapshot-{1}.db".format(os.environ["HOME"], environment)
+
+class Snapshot:
+    """
+    A local copy of the subscriptions of many users in a single Terrain environment, stored in an SQLite database. Each
+    subscription is stored along with the time it was fetched so that the snapshot can be refreshed incrementally by
+    fetching only the subscriptions that are older than a maximum age.
+    """
+
+    def __init__(self, path, create=False):
+        if not create and not os.path.isfile(path):
+            raise FileNotFoundError("snapshot not found: {0}; run the snapshot subcommand first".format(path))
+        if create and not os.path.isfile(path):
+            # The snapshot contains information about other users, so it's only readable by its owner.
+            os.close(os.open(path, os.O_WRONLY | os.O_CREAT, stat.S_IRUSR | stat.S_IWUSR))
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        with self.connection:
+            for statement in schema:
+                self.connection.execute(statement)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Closes the snapshot.
+        """
+        self.connection.close()
+
+    def put(self, username, subscription, fetched=None):
+        """
+        Stores a user's subscription in the snapshot, replacing any earlier copy. Changes aren't saved until commit is
+        called, so that many subscriptions can be stored in a single transaction.
+        """
+        fetched = fetched if fetched is not None else time.time()
+        plan = (subscription.get("plan") or {}).get("name")
+        self.connection.execute("DELETE FROM subscriptions WHERE username = ?", (username,))
+        self.connection.execute(
+            "INSERT INTO subscriptions (username, plan, fetched, subscription) VALUES (?, ?, ?, ?)",
+            (username, plan, fetched, json.dumps(subscription)),
+        )
+        usages = {}
+        for quota in subscription.get("quotas") or []:
+            usages.setdefault(quota["resource_type"]["name"], [None, None])[0] = quota["quota"]
+        for usage in subscription.get("usages") or []:
+            usages.setdefault(usage["resource_type"]["name"], [None, None])[1] = usage["usage"]
+        self.connection.executemany(
+            "INSERT INTO usages (username, resource_type, quota, usage) VALUES (?, ?, ?, ?)",
+            [(username, name, quota, usage) for name, (quota, usage) in usages.items()],
+        )
+
+    def commit(self):
+        """
+        Saves the subscriptions stored since the last commit.
+        """
+        self.connection.commit()
+
+    def get(self, username):
+        """
+        Returns a user's subscription, or None if the user isn't in the snapshot.
+        """
+        row = self.connection.execute(
+            "SELECT subscription FROM subscriptions WHERE username = ?", (username,)
+        ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def usernames(self):
+        """
+        Returns the usernames in the snapshot.
+        """
+        return [row[0] for row in self.connection.execute("SELECT username FROM subscriptions ORDER BY username")]
+
+    def stale_usernames(self, usernames, max_age):
+        """
+        Returns the usernames from an iterable of usernames that either aren't in the snapshot or were fetched more than
+        max_age seconds ago, in their original order.
+        """
+        cutoff = time.time() - max_age
+        fresh = {row[0] for row in self.connection.execute(
+            "SELECT username FROM subscriptions WHERE fetched >= ?", (cutoff,)
+        )}
+        return [username for username in usernames if username not in fresh]
+
+    def subscriptions(self, plan=None, resource_type=None):
+        """
+        Returns an iterator over the username and subscription of each user in the snapshot, optionally limited to the
+        users subscribed to a plan or to the users with a quota or usage for a resource type. Plan and resource type
+        names are matched without regard to case.
+        """
+        query = "SELECT username, subscription FROM subscriptions WHERE 1 = 1"
+        parameters = []
+        if plan is not None:
+            query += " AND plan = ?"
+            parameters.append(plan)
+        if resource_type is not None:
+            query += " AND username IN (SELECT username FROM usages WHERE resource_type = ?)"
+            parameters.append(resource_type)
+        for username, subscription in self.connection.execute(query + " ORDER BY username", parameters):
+            yield username, json.loads(subscription)
+
+    def stats(self):
+        """
+        Returns the number of users in the snapshot and the times at which the oldest and newest subscriptions were
+        fetched.
+        """
+        return self.connection.execute("SELECT COUNT(*), MIN(fetched), MAX(fetched) FROM subscriptions").fetchone()
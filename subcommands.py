@@ -1,18 +1,171 @@
 #!/usr/local/env python3
 
-# A listing of subcommands used to display the information later.
-subcommands = {"help": "list available subcommands"}
+import functools
+import importlib
+import os
+import os.path
+import stat
+import sys
 
-def add_subcommand_description(subcommand, aliases, description):
+# The modules that provide the built-in subcommands. The subcommand names, aliases and descriptions are recorded here so
+# that a module only has to be imported when one of its subcommands is selected.
+subcommand_modules = [
+    {
+        "module": "subscriptions",
+        "subcommand": "subscriptions",
+        "aliases": ["subscription", "sub", "subs"],
+        "description": "subscription operations",
+    },
+    {
+        "module": "shell",
+        "subcommand": "shell",
+        "aliases": ["repl"],
+        "description": "interactive shell",
+    },
+]
+
+# The entry point group in which installed packages register additional subcommand modules. The name of each entry point
+# is a subcommand name and its value is the module that provides the subcommand. A package can register aliases for a
+# subcommand by listing more entry points that refer to the same module; the first one listed is the subcommand name.
+entry_point_group = "terrain.subcommands"
+
+# The description of the help subcommand.
+help_description = "list available subcommands"
+
+# The DE environments that can be selected. These are the environments listed in client.terrain_base_urls; they're
+# listed here so that the client module doesn't have to be loaded just to build the argument parser.
+environments = ["prod", "qa"]
+
+def plugin_cache_path():
+    """
+    Returns the path to the file in which the subcommand modules registered by installed packages are cached.
+    """
+    return "{0}/.terrain-subcommands".format(os.environ["HOME"])
+
+def search_path_signature():
+    """
+    Returns the modification time of each directory on the module search path. Installing or removing a package
+    changes the modification time of the directory that it's installed in, so the cached list of subcommand modules
+    registered by installed packages is only used while the signature stays the same.
+    """
+    signature = []
+    for path in sys.path:
+        try:
+            signature.append([path, os.stat(path or ".").st_mtime])
+        except OSError:
+            pass
+    return signature
+
+def discover_entry_points():
+    """
+    Returns registry entries for the subcommand modules registered by installed packages. Only package metadata is read;
+    none of the modules are imported. The description of each subcommand is the summary of the package that provides it.
+    """
+    import importlib.metadata
+
+    entries = {}
+    for entry_point in importlib.metadata.entry_points(group=entry_point_group):
+        distribution = entry_point.dist
+        key = (distribution.name if distribution is not None else None, entry_point.module)
+        if key in entries:
+            entries[key]["aliases"].append(entry_point.name)
+            continue
+        summary = distribution.metadata["Summary"] if distribution is not None else None
+        entries[key] = {
+            "module": entry_point.module,
+            "subcommand": entry_point.name,
+            "aliases": [],
+            "description": summary or "{0} operations".format(entry_point.name),
+        }
+    return list(entries.values())
+
+@functools.lru_cache(maxsize=None)
+def plugin_subcommand_modules():
+    """
+    Returns registry entries for the subcommand modules registered by installed packages. Scanning the installed
+    packages is slow compared to the rest of the startup time, so the results are cached in $HOME/.terrain-subcommands
+    until a package is installed or removed.
+    """
+    import json
+
+    path = plugin_cache_path()
+    signature = search_path_signature()
+    try:
+        with open(path) as f:
+            cached = json.load(f)
+        if cached["signature"] == signature:
+            return cached["modules"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    modules = discover_entry_points()
+    tmp_path = "{0}.{1}.tmp".format(path, os.getpid())
+    try:
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, stat.S_IRUSR | stat.S_IWUSR)
+        with os.fdopen(fd, "w") as f:
+            json.dump({"signature": signature, "modules": modules}, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return modules
+
+def find_subcommand_module(name, entries=None):
+    """
+    Returns the registry entry for the module that provides a subcommand, or None if no module provides it. The built-in
+    modules are searched if no list of entries is given.
+    """
+    for entry in entries if entries is not None else subcommand_modules:
+        if name == entry["subcommand"] or name in entry["aliases"]:
+            return entry
+    return None
+
+def registered_modules(selected=None):
+    """
+    Returns the registry entries for all available subcommand modules: the built-in modules followed by the modules
+    registered by installed packages. If the selected subcommand is provided by a built-in module then installed
+    packages aren't scanned at all. Registered modules can't replace built-in subcommands; conflicting names are
+    ignored.
+    """
+    if selected is not None and find_subcommand_module(selected) is not None:
+        return subcommand_modules
+
+    entries = list(subcommand_modules)
+    names = {"help"}
+    for entry in entries:
+        names.update([entry["subcommand"]] + entry["aliases"])
+    for entry in plugin_subcommand_modules():
+        if entry["subcommand"] in names:
+            continue
+        aliases = [alias for alias in entry["aliases"] if alias not in names]
+        names.update([entry["subcommand"]] + aliases)
+        entries.append(dict(entry, aliases=aliases))
+    return entries
+
+def load_subcommand_module(entry):
+    """
+    Imports the module described by a registry entry.
+    """
+    try:
+        return importlib.import_module(entry["module"])
+    except ImportError as e:
+        print("unable to load the module for the {0} subcommand: {1}".format(entry["subcommand"], e), file=sys.stderr)
+        sys.exit(1)
+
+def describe_subcommand(entry):
     """
-    Adds a subcommand description to the subcommand listing.
+    Returns the description of a subcommand displayed in the subcommand listing.
     """
-    subcommands[subcommand] = "{0} ({1})".format(description, ",".join(aliases))
+    if not entry["aliases"]:
+        return entry["description"]
+    return "{0} ({1})".format(entry["description"], ",".join(entry["aliases"]))
 
 def list_subcommands(args):
     """
     Lists subcommands available to the user.
     """
+    subcommands = {entry["subcommand"]: describe_subcommand(entry) for entry in registered_modules()}
+    subcommands["help"] = help_description
     print("\nThe following subcommands are available:\n")
     for subcommand in sorted(subcommands.keys()):
         print("    {0}: {1}".format(subcommand, subcommands[subcommand]))
@@ -21,5 +174,27 @@ def add_subcommand_subparser(subparsers):
     """
     Adds a subparser for listing available subcommands.
     """
-    parser = subparsers.add_parser("help", description="list available subcommands")
+    parser = subparsers.add_parser("help", description=help_description)
     parser.set_defaults(func=list_subcommands)
+
+def select_environments(parser, args, default="prod"):
+    """
+    Converts the values of the --env option to a list of distinct environments, stored in args.envs. The first
+    environment is also stored in args.env, which is the environment used by subcommands that only work with one. The
+    default environment is used if the option wasn't given. Subcommands that accept several environments set
+    multiple_environments in their parser defaults.
+    """
+    envs = []
+    for value in args.env or [default]:
+        for env in value.split(","):
+            env = env.strip()
+            if env not in environments:
+                parser.error("argument -e/--env: invalid choice: '{0}' (choose from {1})".format(
+                    env, ", ".join(environments)
+                ))
+            if env not in envs:
+                envs.append(env)
+    if len(envs) > 1 and not getattr(args, "multiple_environments", False):
+        parser.error("only one environment may be selected for this subcommand")
+    args.envs = envs
+    args.env = envs[0]
@@ -2,53 +2,222 @@
 
 import argparse
 import client
-import jwt
-import pprint
-import re
+import concurrent.futures
+import contextlib
+import csv
+import json
+import journal
+import os.path
+import quotas
+import renderers
 import sys
+import time
+import usage
 
-# Unit conversions
-conversions = {
-    "": 1,
-    "K": 2**10,
-    "M": 2**20,
-    "G": 2**30,
-    "T": 2**40,
-}
+def format_plan(plan):
+    """
+    Formats a subscription plan for display. The quota defaults are sorted by resource type name.
+    """
+    lines = ["{0}:".format(plan["name"])]
+    for quota_default in sorted(plan["plan_quota_defaults"], key=lambda qd: qd["resource_type"]["name"]):
+        lines.append("    {0}: {1}".format(quota_default["resource_type"]["name"], quota_default["quota_value"]))
+    return lines
+
+def plan_csv_rows(plan):
+    """
+    Converts a subscription plan to CSV rows, with one row per quota default.
+    """
+    quota_defaults = plan["plan_quota_defaults"]
+    if len(quota_defaults) == 0:
+        return [[plan["name"], None, None]]
+    return [[plan["name"], qd["resource_type"]["name"], qd["quota_value"]] for qd in quota_defaults]
+
+def format_resource_type(resource_type):
+    """
+    Formats a resource type for display.
+    """
+    return ["{0}: {1}".format(resource_type["name"], resource_type["unit"])]
+
+def format_subscription(subscription):
+    """
+    Formats a subscription for display. The quotas and usages are sorted by resource type name.
+    """
+    lines = [
+        "Effective Starting: {0}".format(subscription["effective_start_date"]),
+        "Expires At: {0}".format(subscription["effective_end_date"]),
+        "Plan: {0}".format(subscription["plan"]["name"]),
+        "Quotas:",
+    ]
+    quotas = subscription["quotas"] if "quotas" in subscription else []
+    for quota in sorted(quotas, key=lambda q: q["resource_type"]["name"]):
+        lines.append("    {0}: {1}".format(quota["resource_type"]["name"], quota["quota"]))
+    lines.append("Usages:")
+    usages = subscription["usages"] if "usages" in subscription else []
+    for usage in sorted(usages, key=lambda u: u["resource_type"]["name"]):
+        lines.append("    {0}: {1}".format(usage["resource_type"]["name"], usage["usage"]))
+    return lines
+
+def subscription_csv_rows(subscription, prefix=[]):
+    """
+    Converts a subscription to CSV rows, with one row per resource type that has a quota or usage.
+    """
+    quotas = {q["resource_type"]["name"]: q["quota"] for q in subscription.get("quotas") or []}
+    usages = {u["resource_type"]["name"]: u["usage"] for u in subscription.get("usages") or []}
+    common = prefix + [subscription["plan"]["name"], subscription["effective_start_date"],
+                       subscription["effective_end_date"]]
+    names = list(quotas) + [name for name in usages if name not in quotas]
+    if len(names) == 0:
+        return [common + [None, None, None]]
+    return [common + [name, quotas.get(name), usages.get(name)] for name in names]
+
+def format_user_subscription(record):
+    """
+    Formats a user's subscription for display, preceded by the username and followed by a blank line.
+    """
+    return ["User: {0}".format(record["username"])] + format_subscription(record["subscription"]) + [""]
+
+def format_bulk_result(result):
+    """
+    Formats the result of applying a single manifest row for display.
+    """
+    return ["line {0}: {1}: {2}".format(result["line"], result["user"], result["message"])]
+
+def format_sync_change(change):
+    """
+    Formats a change made (or planned) by the sync subcommand for display.
+    """
+    if change["action"] == "plan":
+        target = "plan"
+    elif change["action"] == "quota":
+        target = change["resource_type"]
+    else:
+        return ["{0}: {1}".format(change["user"], change["message"])]
+    text = "{0}: {1}: {2} -> {3}".format(change["user"], target, change["current"], change["desired"])
+    if change["status"] != "applied":
+        text += " ({0})".format(change["status"] if change["message"] is None else change["message"])
+    return [text]
+
+def format_usage_summary(summary):
+    """
+    Formats the usage summary for a resource type for display.
+    """
+    lines = [
+        "{0}:".format(summary["resource_type"]),
+        "    Users: {0}".format(summary["users"]),
+        "    Total Quota: {0}".format(summary["total_quota"]),
+        "    Total Usage: {0}".format(summary["total_usage"]),
+        "    Usage Ratio: {0:.3f}".format(summary["usage_ratio"]),
+        "    Over Quota: {0}".format(summary["over_quota"]),
+        "    Usage Ratio Percentiles:",
+    ]
+    for name, value in summary["percentiles"].items():
+        lines.append("        {0}: {1:.3f}".format(name, value))
+    lines.append("    Closest to Quota:")
+    for entry in summary["closest_to_quota"]:
+        lines.append("        {0}: {1:.3f} ({2} of {3})".format(entry["user"], entry["ratio"], entry["usage"],
+                                                             entry["quota"]))
+    return lines
+
+def format_watch_event(event):
+    """
+    Formats a change or alert reported by the watch subcommand for display.
+    """
+    prefix = "{0} {1}:".format(event["time"][11:], event["user"])
+    if event["event"] in ["alert", "error"]:
+        return ["{0} {1}: {2}".format(prefix, event["event"].upper(), event["message"])]
+    target = "plan" if event["event"] == "plan" else "{0} {1}".format(event["resource_type"], event["event"])
+    text = "{0} {1}: {2} -> {3}".format(prefix, target, event["previous"], event["current"])
+    if event["event"] != "plan" and event["previous"] is not None and event["current"] is not None:
+        text += " ({0:+})".format(event["current"] - event["previous"])
+    return [text]
+
+def format_comparison(difference):
+    """
+    Formats a difference between environments found by the compare subcommand for display.
+    """
+    subject = "{0} {1}".format(difference["category"].replace("_", " "), difference["name"])
+    values = difference["values"]
+    if difference["field"] is None:
+        return ["{0}: missing from {1}".format(subject, ", ".join(env for env, found in values.items() if not found))]
+    if difference["field"] == "error":
+        return ["{0}: error in {1}: {2}".format(subject, env, message) for env, message in values.items()]
+    return ["{0}: {1}: {2}".format(
+        subject, difference["field"], " ".join("{0}={1}".format(env, value) for env, value in values.items())
+    )]
+
+def usage_summary_csv_rows(summary):
+    """
+    Converts the usage summary for a resource type to a single CSV row. The users closest to their quotas are combined
+    into a single column.
+    """
+    closest = ";".join("{0}:{1:.3f}".format(e["user"], e["ratio"]) for e in summary["closest_to_quota"])
+    return [[summary[k] for k in ["resource_type", "users", "total_quota", "total_usage", "usage_ratio", "over_quota"]]
+            + list(summary["percentiles"].values()) + [closest]]
+
+subscription_csv_columns = ["plan", "effective_start_date", "effective_end_date", "resource_type", "quota", "usage"]
+
+renderers.register_record_kind("plan", format_plan, ["plan", "resource_type", "quota_value"], plan_csv_rows)
+renderers.register_record_kind(
+    "resource_type", format_resource_type, ["name", "unit"], lambda rt: [[rt["name"], rt["unit"]]]
+)
+renderers.register_record_kind("subscription", format_subscription, subscription_csv_columns, subscription_csv_rows)
+renderers.register_record_kind(
+    "user_subscription", format_user_subscription, ["username"] + subscription_csv_columns,
+    lambda r: subscription_csv_rows(r["subscription"], [r["username"]])
+)
+renderers.register_record_kind(
+    "bulk_result", format_bulk_result, ["line", "user", "status", "message"],
+    lambda r: [[r["line"], r["user"], r["status"], r["message"]]]
+)
+renderers.register_record_kind(
+    "usage_summary", format_usage_summary,
+    ["resource_type", "users", "total_quota", "total_usage", "usage_ratio", "over_quota"] +
+    ["p{0}".format(p) for p in usage.report_percentiles] + ["closest_to_quota"],
+    usage_summary_csv_rows
+)
+
+renderers.register_record_kind(
+    "watch_event", format_watch_event,
+    ["time", "user", "event", "resource_type", "previous", "current", "message"],
+    lambda e: [[e[k] for k in ["time", "user", "event", "resource_type", "previous", "current", "message"]]]
+)
+
+renderers.register_record_kind(
+    "comparison", format_comparison, ["category", "name", "field", "environment", "value"],
+    lambda d: [[d["category"], d["name"], d["field"], env, value] for env, value in d["values"].items()]
+)
+
+renderers.register_record_kind(
+    "sync_change", format_sync_change,
+    ["user", "action", "resource_type", "current", "desired", "status", "message"],
+    lambda c: [[c[k] for k in ["user", "action", "resource_type", "current", "desired", "status", "message"]]]
+)
+
+def render_records(args, kind, records):
+    """
+    Renders records using the output format selected on the command line.
+    """
+    with renderers.get_renderer(args.output) as renderer:
+        for record in records:
+            renderer.render(kind, record)
 
 def list_plans(args):
     """
     Lists available subscription plans.
     """
-    plans = client.list_plans(args.env)
-    for plan in plans:
-        print("{0}:".format(plan["name"]))
-        for quota_default in sorted(plan["plan_quota_defaults"], key=lambda qd: qd["resource_type"]["name"]):
-            print("    {0}: {1}".format(quota_default["resource_type"]["name"], quota_default["quota_value"]))
+    render_records(args, "plan", client.list_plans(args.env))
 
 def list_resource_types(args):
     """
     Lists available resource types.
     """
-    resource_types = client.list_resource_types(args.env)
-    for resource_type in resource_types:
-        print("{0}: {1}".format(resource_type["name"], resource_type["unit"]))
+    render_records(args, "resource_type", client.list_resource_types(args.env))
 
-def display_subscription(subscription):
+def display_subscription(args, subscription):
     """
     Displays the given subscription.
     """
-    print("Effective Starting:", subscription["effective_start_date"])
-    print("Expires At:", subscription["effective_end_date"])
-    print("Plan:", subscription["plan"]["name"])
-    print("Quotas:")
-    quotas = subscription["quotas"] if "quotas" in subscription else []
-    for quota in sorted(quotas, key=lambda q: q["resource_type"]["name"]):
-        print("    {0}: {1}".format(quota["resource_type"]["name"], quota["quota"]))
-    print("Usages:")
-    usages = subscription["usages"] if "usages" in subscription else []
-    for usage in sorted(usages, key=lambda u: u["resource_type"]["name"]):
-        print("    {0}: {1}".format(usage["resource_type"]["name"], usage["usage"]))
+    render_records(args, "subscription", [subscription])
 
 def get_subscription(args):
     """
@@ -56,16 +225,209 @@ def get_subscription(args):
     then the user's current subscription is obtained using the non-admin endpoint. Otherwise, the admin end point is
     called to get the current user's subscription.
     """
+    if args.offline:
+        get_snapshot_subscriptions(args)
+        return
+    if args.users_file is not None:
+        get_subscriptions(args)
+        return
     user = args.user
     if user is not None:
-        auth_user = jwt.get_username(client.get_access_token(args.env))
+        auth_user = client.get_authenticated_username(args.env)
         if auth_user != user:
             if not client.is_valid_username(args.env, user):
                 print("user does not exist:", user, file=sys.stderr)
                 return
-            display_subscription(client.admin_get_subscription(args.env, user))
+            display_subscription(args, client.admin_get_subscription(args.env, user))
             return
-    display_subscription(client.get_subscription(args.env))
+    display_subscription(args, client.get_subscription(args.env))
+
+def read_usernames(path):
+    """
+    Reads usernames from a file containing one username per line, skipping blank lines. A path of - refers to standard
+    input. The usernames are read lazily so that large files are never loaded into memory all at once.
+    """
+    f = sys.stdin if path == "-" else open(path)
+    try:
+        for line in f:
+            username = line.strip()
+            if username != "":
+                yield username
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+def prepare_workers(args, env=None, threads=True):
+    """
+    Prepares to send requests to an environment, args.env by default, from args.concurrency concurrent workers. The
+    user is authenticated up front so that the workers never stop at a login prompt, which would also block the event
+    loop when the workers are asyncio tasks. When the workers are threads, the connection pool is sized to match.
+    """
+    env = env if env is not None else args.env
+    if threads:
+        client.configure_client(env, pool_size=args.concurrency)
+    client.get_access_token(env)
+
+def get_subscriptions(args):
+    """
+    Gets the subscriptions for each of the users listed in a file, displaying each subscription as soon as it's
+    received. The requests are sent concurrently. Administrative access is required to use this subcommand.
+    """
+    # The async client is imported here because importing aiohttp is slow and most subcommands don't need it.
+    import asyncio
+    import client_async
+
+    async def display_subscriptions(renderer):
+        async with client_async.AsyncTerrainClient(args.env, args.concurrency, args.timeout) as terrain:
+            async for user, subscription, error in terrain.admin_get_subscriptions(read_usernames(args.users_file)):
+                if error is not None:
+                    failures.append(user)
+                    print("unable to get the subscription for {0}: {1}".format(user, error), file=sys.stderr)
+                    continue
+                renderer.render("user_subscription", {"username": user, "subscription": subscription})
+
+    prepare_workers(args, threads=False)
+    failures = []
+    with renderers.get_renderer(args.output) as renderer:
+        asyncio.run(display_subscriptions(renderer))
+    if len(failures) > 0:
+        sys.exit(1)
+
+def open_snapshot(args, create=False):
+    """
+    Opens the subscription snapshot selected by the command-line arguments.
+    """
+    # The snapshot module is imported here because only a few subcommands use it.
+    import snapshot
+
+    path = args.snapshot if args.snapshot is not None else snapshot.default_path(args.env)
+    try:
+        return snapshot.Snapshot(path, create)
+    except FileNotFoundError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+def get_snapshot_subscriptions(args):
+    """
+    Displays subscriptions from the local snapshot rather than fetching them from Terrain, for either a single user or
+    each of the users listed in a file.
+    """
+    if args.user is None and args.users_file is None:
+        print("--offline requires --user or --users-file", file=sys.stderr)
+        sys.exit(1)
+    missing = []
+    with open_snapshot(args) as snap:
+        if args.user is not None:
+            subscription = snap.get(args.user)
+            if subscription is None:
+                print("user not found in the snapshot:", args.user, file=sys.stderr)
+                sys.exit(1)
+            display_subscription(args, subscription)
+            return
+        with renderers.get_renderer(args.output) as renderer:
+            for user in read_usernames(args.users_file):
+                subscription = snap.get(user)
+                if subscription is None:
+                    missing.append(user)
+                    print("user not found in the snapshot:", user, file=sys.stderr)
+                    continue
+                renderer.render("user_subscription", {"username": user, "subscription": subscription})
+    if len(missing) > 0:
+        sys.exit(1)
+
+def take_snapshot(args):
+    """
+    Stores the subscriptions of the users listed in a file in the local snapshot. Only the subscriptions that aren't in
+    the snapshot or that are older than the maximum age are fetched, unless --full is used. If no users file is given,
+    the users who are already in the snapshot are refreshed. The subscriptions are fetched concurrently and saved in
+    batches as they arrive. Administrative access is required to use this subcommand.
+    """
+    import asyncio
+    import client_async
+
+    async def fetch_subscriptions(usernames):
+        async with client_async.AsyncTerrainClient(args.env, args.concurrency, args.timeout) as terrain:
+            async for user, subscription, error in terrain.admin_get_subscriptions(usernames):
+                if error is not None:
+                    counts["failures"] += 1
+                    print("unable to get the subscription for {0}: {1}".format(user, error), file=sys.stderr)
+                    continue
+                snap.put(user, subscription)
+                counts["fetched"] += 1
+                if counts["fetched"] % 500 == 0:
+                    snap.commit()
+        snap.commit()
+
+    counts = {"fetched": 0, "failures": 0}
+    with open_snapshot(args, create=True) as snap:
+        usernames = list(read_usernames(args.users_file)) if args.users_file is not None else snap.usernames()
+        stale = usernames if args.full else snap.stale_usernames(usernames, args.max_age)
+        if len(stale) > 0:
+            prepare_workers(args, threads=False)
+            asyncio.run(fetch_subscriptions(stale))
+        total = snap.stats()[0]
+    with renderers.get_renderer(args.output) as renderer:
+        renderer.message("{0} fetched, {1} up to date, {2} failures; {3} users in the snapshot".format(
+            counts["fetched"], len(usernames) - len(stale), counts["failures"], total
+        ))
+    if counts["failures"] > 0:
+        sys.exit(1)
+
+def usage_report(args):
+    """
+    Reports resource usage relative to quotas for each of the users listed in a file. The subscriptions are fetched
+    concurrently and aggregated as they arrive, so memory usage doesn't grow with the number of users. With --offline,
+    the subscriptions are read from the local snapshot instead, and every user in the snapshot is included if no users
+    file is given. Administrative access is required to use this subcommand unless --offline is used.
+    """
+    import asyncio
+    import client_async
+
+    async def aggregate_subscriptions():
+        async with client_async.AsyncTerrainClient(args.env, args.concurrency, args.timeout) as terrain:
+            async for user, subscription, error in terrain.admin_get_subscriptions(read_usernames(args.users_file)):
+                if error is not None:
+                    counts["failures"] += 1
+                    print("unable to get the subscription for {0}: {1}".format(user, error), file=sys.stderr)
+                    continue
+                add_matching(user, subscription)
+
+    def aggregate_snapshot_subscriptions():
+        with open_snapshot(args) as snap:
+            if args.users_file is None:
+                for user, subscription in snap.subscriptions(plan=args.plan):
+                    aggregator.add(user, subscription)
+                return
+            for user in read_usernames(args.users_file):
+                subscription = snap.get(user)
+                if subscription is None:
+                    counts["failures"] += 1
+                    print("user not found in the snapshot:", user, file=sys.stderr)
+                    continue
+                add_matching(user, subscription)
+
+    def add_matching(user, subscription):
+        plan_name = (subscription.get("plan") or {}).get("name") or ""
+        if args.plan is None or plan_name.lower() == args.plan.lower():
+            aggregator.add(user, subscription)
+
+    if args.users_file is None and not args.offline:
+        print("--users-file is required unless --offline is used", file=sys.stderr)
+        sys.exit(1)
+
+    aggregator = usage.UsageAggregator(args.top)
+    counts = {"failures": 0}
+    if args.offline:
+        aggregate_snapshot_subscriptions()
+    else:
+        prepare_workers(args, threads=False)
+        asyncio.run(aggregate_subscriptions())
+    with renderers.get_renderer(args.output) as renderer:
+        renderer.message("{0} subscriptions, {1} failures".format(aggregator.subscriptions, counts["failures"]))
+        for summary in aggregator.summaries():
+            renderer.render("usage_summary", summary)
+    if counts["failures"] > 0:
+        sys.exit(1)
 
 def add_subscription(args):
     """
@@ -81,22 +443,29 @@ def add_subscription(args):
         print("plan does not exist:", args.plan, file=sys.stderr)
         sys.exit(1)
     client.admin_add_subscription(args.env, user, plan)
-    display_subscription(client.admin_get_subscription(args.env, user))
+    display_subscription(args, client.admin_get_subscription(args.env, user))
 
-def convert_quota(spec):
+def current_quota_and_usage(subscription, resource_type):
     """
-    Converts a quota specification to a raw quota. The quota should be specified in numbers and unit conversions.
-    Supported unit conversions are K (2^10 or 1024 units), M (2^20 units), G (2^30 units) and T (2^40 units). For
-    example, a specification of 2K will be converted to 2*2^20 or 2048.
+    Returns the quota and usage for a resource type in a subscription. Either one may be None.
     """
-    m = re.match(r'^(\d+(?:\.\d+)?)\s?([KkMmGgTt])?$', spec)
-    if m is None:
-        return None
-    conversion = m.group(2) or ""
-    conversion = conversion.upper()
-    if conversion not in conversions:
-        return None
-    return int(float(m.group(1)) * conversions[conversion])
+    find = lambda entries: next(
+        (e for e in entries or [] if e["resource_type"]["name"].lower() == resource_type.lower()), {}
+    )
+    subscription = subscription or {}
+    return find(subscription.get("quotas")).get("quota"), find(subscription.get("usages")).get("usage")
+
+def resolve_quota(environment, user, resource_type, expression):
+    """
+    Evaluates a compiled quota expression for a user and resource type. The user's current subscription is only
+    fetched if the expression is relative to the current quota or usage. A ValueError is raised if the expression can't
+    be evaluated.
+    """
+    quota, usage = None, None
+    if expression.relative:
+        quota, usage = current_quota_and_usage(client.admin_get_subscription(environment, user), resource_type["name"])
+    kind = quotas.dimension(resource_type.get("unit"))
+    return quotas.to_raw_quota(expression.evaluate(quota, usage), kind)
 
 def set_quota(args):
     """
@@ -107,27 +476,638 @@ def set_quota(args):
     if not client.is_valid_username(args.env, user):
         print("user does not exist:", user, file=sys.stderr)
         sys.exit(1)
-    resource_type = client.validate_resource_type_name(args.env, args.resource_type)
+    resource_type = client.resource_type_index(args.env).get(args.resource_type.lower())
     if resource_type is None:
         print("resource type does not exist:", args.resource_type, file=sys.stderr)
         sys.exit(1)
-    quota = convert_quota(args.quota)
-    if quota is None:
-        print("invalid quota specification:", args.quota, file=sys.stderr)
+    try:
+        expression = quotas.compile_quota(args.quota.strip(), quotas.dimension(resource_type.get("unit")))
+        quota = resolve_quota(args.env, user, resource_type, expression)
+    except ValueError as e:
+        print("invalid quota specification:", e, file=sys.stderr)
         sys.exit(1)
-    display_subscription(client.admin_set_quota(args.env, user, resource_type, quota))
+    display_subscription(args, client.admin_set_quota(args.env, user, resource_type["name"], quota))
+
+def read_manifest(path, manifest_format):
+    """
+    Reads a bulk operation manifest one row at a time. Each row is returned as a tuple containing the line number, a
+    dictionary of the values in the row and an error message. If a row can't be parsed, the dictionary is None and the
+    error message describes the problem; otherwise, the error message is None. CSV manifests must have a header row.
+    JSONL manifests must have one JSON object per line. The format is determined from the file extension if it's not
+    specified explicitly.
+    """
+    if manifest_format is None:
+        manifest_format = "jsonl" if os.path.splitext(path)[1].lower() in [".jsonl", ".ndjson"] else "csv"
+    # Spreadsheet programs often save CSV files with a byte order mark, which would otherwise end up in the first
+    # header.
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        if manifest_format == "csv":
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row, None
+        else:
+            for line_num, line in enumerate(f, start=1):
+                if line.strip() == "":
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    yield line_num, None, "invalid JSON: {0}".format(e)
+                    continue
+                if not isinstance(row, dict):
+                    yield line_num, None, "invalid row: expected a JSON object"
+                    continue
+                yield line_num, row, None
+
+def manifest_value(row, key):
+    """
+    Returns a stripped value from a manifest row, or None if the value is missing or empty.
+    """
+    value = row.get(key)
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value if value != "" else None
+
+def validate_manifest_row(row, plans, resource_types):
+    """
+    Validates a single manifest row against the plan and resource type indexes, which are dictionaries mapping
+    lower-case names to catalog entries. Returns a tuple containing the normalized operation and an error message.
+    """
+    user = manifest_value(row, "user")
+    if user is None:
+        return None, "no user specified"
+    operation = {"user": user, "plan": None, "resource_type": None, "quota": None, "quota_expression": None}
+
+    plan_name = manifest_value(row, "plan")
+    if plan_name is not None:
+        plan = plans.get(plan_name.lower())
+        if plan is None:
+            return None, "plan does not exist: {0}".format(plan_name)
+        operation["plan"] = plan["name"]
+
+    resource_type_name = manifest_value(row, "resource_type")
+    quota_spec = manifest_value(row, "quota")
+    if (resource_type_name is None) != (quota_spec is None):
+        return None, "resource_type and quota must be specified together"
+    if resource_type_name is not None:
+        resource_type = resource_types.get(resource_type_name.lower())
+        if resource_type is None:
+            return None, "resource type does not exist: {0}".format(resource_type_name)
+        operation["resource_type"] = resource_type["name"]
+        try:
+            kind = quotas.dimension(resource_type.get("unit"))
+            expression = quotas.compile_quota(quota_spec, kind)
+        except ValueError as e:
+            return None, "invalid quota specification: {0}".format(e)
 
-def list_module_subcommands():
+        # Relative quotas can only be evaluated once the user's current subscription has been fetched.
+        if expression.relative:
+            operation["quota_expression"] = expression.spec
+        else:
+            operation["quota"] = quotas.to_raw_quota(expression.evaluate(), kind)
+
+    if operation["plan"] is None and operation["resource_type"] is None:
+        return None, "nothing to do for user: {0}".format(user)
+    return operation, None
+
+def apply_manifest_operation(environment, operation, prior, attempts):
     """
-    Returns a list of subcommands that are used to access thismodule.
+    Applies a validated manifest operation. If another operation for the same user was submitted earlier, it's passed
+    in as prior so that operations for a single user are applied in manifest order. Each call to Terrain is attempted up
+    to the given number of times if it fails with a retryable error.
     """
-    return ["subscriptions", "subscription", "sub", "subs"]
+    if prior is not None:
+        concurrent.futures.wait([prior])
+    user = operation["user"]
+    if not client.call_with_retries(client.is_valid_username, environment, user, attempts=attempts):
+        raise Exception("user does not exist: {0}".format(user))
+    actions = []
+    if operation["plan"] is not None:
+        client.call_with_retries(client.admin_add_subscription, environment, user, operation["plan"], attempts=attempts)
+        actions.append("plan={0}".format(operation["plan"]))
+    if operation["resource_type"] is not None:
+        quota = operation["quota"]
+        if operation["quota_expression"] is not None:
+            resource_type = client.resource_type_index(environment)[operation["resource_type"].lower()]
+            dimension = quotas.dimension(resource_type.get("unit"))
+            expression = quotas.compile_quota(operation["quota_expression"], dimension)
+            quota = client.call_with_retries(resolve_quota, environment, user, resource_type, expression,
+                                             attempts=attempts)
+        client.call_with_retries(
+            client.admin_set_quota, environment, user, operation["resource_type"], quota, attempts=attempts
+        )
+        actions.append("{0}={1}".format(operation["resource_type"], quota))
+    return ", ".join(actions)
 
-def get_module_description():
+def manifest_operation_key(line_num, operation):
     """
-    Returns a brief description of the module.
+    Returns the key used to identify a manifest operation in the journal. The line number is included so that a user
+    whose settings are changed more than once in a manifest has each change applied in order, and the operation itself
+    is included so that rows that were edited between runs are applied again.
     """
-    return "subscription operations"
+    return "{0}:{1}".format(line_num, json.dumps(operation, sort_keys=True))
+
+def open_journal(args, path):
+    """
+    Opens the journal for a bulk operation. The journal is stored next to the input file unless a path was specified
+    explicitly. An existing journal is only read if the operation is being resumed; otherwise it's replaced.
+    """
+    path = args.journal if args.journal is not None else path + ".journal"
+    if args.resume and not os.path.isfile(path):
+        print("journal not found; processing every item:", path, file=sys.stderr)
+    return journal.Journal(path, resume=args.resume)
+
+def bulk_apply(args):
+    """
+    Applies subscription plans and quotas to users listed in a CSV or JSONL manifest. Each row may contain the columns
+    user, plan, resource_type and quota. Rows are read and validated as the manifest is streamed, and the resulting
+    Terrain calls are made by a bounded pool of worker threads. The result for each row is reported as it completes and
+    recorded in a journal so that an interrupted run can be resumed with --resume, skipping the rows that were already
+    applied. Administrative access is required to use this subcommand.
+    """
+    prepare_workers(args)
+    plans = client.plan_index(args.env)
+    resource_types = client.resource_type_index(args.env)
+
+    counts = {"succeeded": 0, "failed": 0, "skipped": 0}
+    def report(line_num, user, message, succeeded):
+        status = "succeeded" if succeeded else "failed"
+        counts[status] += 1
+        result = {"line": line_num, "user": user, "status": status, "message": message}
+        renderer.render("bulk_result", result, error=not succeeded)
+
+    pending = {}
+    latest_by_user = {}
+    def report_completed(futures):
+        for future in futures:
+            line_num, user, key = pending.pop(future)
+            if latest_by_user.get(user) is future:
+                del latest_by_user[user]
+            try:
+                message = future.result()
+                bulk_journal.record(key, "done", message)
+                report(line_num, user, message, True)
+            except Exception as e:
+                bulk_journal.record(key, "failed", str(e))
+                report(line_num, user, "error: {0}".format(e), False)
+
+    renderer = renderers.get_renderer(args.output)
+    with renderer, open_journal(args, args.file) as bulk_journal, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for line_num, row, error in read_manifest(args.file, args.format):
+            if error is None:
+                operation, error = validate_manifest_row(row, plans, resource_types)
+            if error is not None:
+                report(line_num, manifest_value(row, "user") if row is not None else None, error, False)
+                continue
+            key = manifest_operation_key(line_num, operation)
+            if bulk_journal.is_done(key):
+                counts["skipped"] += 1
+                continue
+
+            # Limit the number of rows in flight so that large manifests are never read into memory all at once.
+            if len(pending) >= args.concurrency * 2:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                report_completed(done)
+
+            user = operation["user"]
+            prior = latest_by_user.get(user)
+            future = executor.submit(apply_manifest_operation, args.env, operation, prior, args.max_attempts)
+            pending[future] = (line_num, user, key)
+            latest_by_user[user] = future
+        report_completed(concurrent.futures.as_completed(list(pending)))
+        renderer.message("{0} succeeded, {1} failed, {2} already done".format(
+            counts["succeeded"], counts["failed"], counts["skipped"]
+        ))
+    if counts["failed"] > 0:
+        sys.exit(1)
+
+def load_policy(path):
+    """
+    Loads a desired-state policy file. Files with a .json extension are parsed as JSON; everything else is parsed as
+    YAML.
+    """
+    with open(path) as f:
+        if os.path.splitext(path)[1].lower() == ".json":
+            return json.load(f)
+
+        # PyYAML is only needed by this subcommand, so it's imported here.
+        import yaml
+        return yaml.safe_load(f)
+
+def normalize_policy(policy, plans, resource_types):
+    """
+    Validates a desired-state policy and converts it to a dictionary mapping each username to the desired plan name (or
+    None) and a dictionary of desired raw quotas keyed by resource type name. Settings in the optional defaults section
+    apply to every user unless the user's own entry overrides them. Quotas must be absolute, because relative quotas
+    would change the desired state every time the policy was applied. The quotas for each resource type are converted
+    as a single column, so policies with many users only convert each distinct quota specification once. Returns the
+    normalized policy and a list of error messages.
+    """
+    errors = []
+    if not isinstance(policy, dict) or not isinstance(policy.get("users"), dict):
+        return {}, ["the policy must contain a users section mapping usernames to settings"]
+    entries = [("defaults", policy.get("defaults") or {})]
+    entries.extend((str(user), settings or {}) for user, settings in policy["users"].items())
+
+    # Validate the plans and collect the quota specifications for each resource type.
+    entry_plans = []
+    columns = {}
+    for i, (context, settings) in enumerate(entries):
+        plan = None
+        if not isinstance(settings, dict):
+            errors.append("{0}: the settings must be a mapping containing plan and quotas".format(context))
+            entry_plans.append(None)
+            continue
+        if settings.get("plan") is not None:
+            plan = plans.get(str(settings["plan"]).lower())
+            if plan is None:
+                errors.append("{0}: plan does not exist: {1}".format(context, settings["plan"]))
+        entry_plans.append(plan["name"] if plan is not None else None)
+        if not isinstance(settings.get("quotas") or {}, dict):
+            errors.append("{0}: quotas must be a mapping of resource type names to quotas".format(context))
+            continue
+        for name, spec in (settings.get("quotas") or {}).items():
+            resource_type = resource_types.get(str(name).lower())
+            if resource_type is None:
+                errors.append("{0}: resource type does not exist: {1}".format(context, name))
+                continue
+            columns.setdefault(resource_type["name"], []).append((i, spec))
+
+    # Convert the quota specifications one resource type at a time.
+    entry_quotas = [{} for _ in entries]
+    for name, column in columns.items():
+        unit = resource_types[name.lower()].get("unit")
+        converted = quotas.convert_column([spec for _, spec in column], unit)
+        for (i, spec), (quota, error) in zip(column, converted):
+            if error is not None:
+                errors.append("{0}: invalid quota specification: {1}".format(entries[i][0], error))
+                continue
+            entry_quotas[i][name] = quota
+
+    desired = {}
+    for i, (user, _) in enumerate(entries[1:], start=1):
+        desired[user] = {"plan": entry_plans[i] or entry_plans[0], "quotas": dict(entry_quotas[0], **entry_quotas[i])}
+    return desired, errors
+
+def diff_subscription(user, subscription, desired, plans):
+    """
+    Computes the minimal list of changes needed to bring a user's subscription to the desired state. Changing the plan
+    resets the quotas to the new plan's defaults, so quotas are compared against those defaults when the plan changes.
+    """
+    changes = []
+    current_plan = subscription["plan"]["name"] if subscription is not None else None
+    current_quotas = {q["resource_type"]["name"]: q["quota"] for q in (subscription or {}).get("quotas") or []}
+
+    if desired["plan"] is not None and (current_plan is None or current_plan.lower() != desired["plan"].lower()):
+        changes.append({"user": user, "action": "plan", "resource_type": None, "current": current_plan,
+                        "desired": desired["plan"]})
+        plan = plans[desired["plan"].lower()]
+        current_quotas = {qd["resource_type"]["name"]: qd["quota_value"] for qd in plan["plan_quota_defaults"]}
+
+    for resource_type, quota in sorted(desired["quotas"].items()):
+        current = current_quotas.get(resource_type)
+        if current is None or float(current) != float(quota):
+            changes.append({"user": user, "action": "quota", "resource_type": resource_type, "current": current,
+                            "desired": quota})
+    return changes
+
+def sync_user(environment, user, desired, plans, dry_run, attempts):
+    """
+    Fetches a user's current subscription, computes the changes needed to reach the desired state and, unless this is
+    a dry run, applies them in order. Each call to Terrain is attempted up to the given number of times if it fails with
+    a retryable error. Returns the list of changes along with their statuses.
+    """
+    subscription = client.call_with_retries(client.admin_get_subscription, environment, user, attempts=attempts)
+    changes = diff_subscription(user, subscription, desired, plans)
+    for i, change in enumerate(changes):
+        change["status"], change["message"] = "planned", None
+        if dry_run:
+            continue
+        try:
+            if change["action"] == "plan":
+                client.call_with_retries(
+                    client.admin_add_subscription, environment, user, change["desired"], attempts=attempts
+                )
+            else:
+                client.call_with_retries(
+                    client.admin_set_quota, environment, user, change["resource_type"], change["desired"],
+                    attempts=attempts
+                )
+            change["status"] = "applied"
+        except Exception as e:
+            change["status"], change["message"] = "failed", "error: {0}".format(e)
+            for skipped in changes[i + 1:]:
+                skipped["status"], skipped["message"] = "skipped", "skipped after an earlier failure"
+            break
+    return changes
+
+def sync_subscriptions(args):
+    """
+    Brings user subscriptions in line with a desired-state policy file. The current subscriptions are fetched
+    concurrently and compared to the policy, and only the plan changes and quota updates that actually change something
+    are sent to Terrain. With --dry-run, the changes are displayed without being applied. Users whose subscriptions were
+    brought in line with the policy are recorded in a journal so that an interrupted run can be resumed with --resume
+    without checking those users again. Administrative access is required to use this subcommand.
+    """
+    prepare_workers(args)
+    plans = client.plan_index(args.env)
+    desired, errors = normalize_policy(load_policy(args.desired), plans, client.resource_type_index(args.env))
+    for error in errors:
+        print(error, file=sys.stderr)
+    if len(errors) > 0:
+        sys.exit(1)
+
+    # A dry run doesn't change anything, so there's nothing to record in the journal. The journal key includes the
+    # user's desired state so that users whose entries were edited between runs are checked again.
+    user_key = lambda user: "{0}:{1}".format(user, json.dumps(desired[user], sort_keys=True))
+    counts = {"users": 0, "planned": 0, "applied": 0, "failed": 0, "skipped": 0}
+    with renderers.get_renderer(args.output) as renderer, \
+            open_journal(args, args.desired) if not args.dry_run else contextlib.nullcontext() as sync_journal, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        users = [u for u in desired if sync_journal is None or not sync_journal.is_done(user_key(u))]
+        valid_users = client.call_with_retries(
+            client.validate_usernames, args.env, users, args.concurrency, attempts=args.max_attempts
+        )
+        futures = {}
+        for user, valid in valid_users.items():
+            if not valid:
+                counts["failed"] += 1
+                change = {"user": user, "action": "validate", "resource_type": None, "current": None,
+                          "desired": None, "status": "failed", "message": "user does not exist: {0}".format(user)}
+                renderer.render("sync_change", change, error=True)
+                continue
+            future = executor.submit(sync_user, args.env, user, desired[user], plans, args.dry_run, args.max_attempts)
+            futures[future] = user
+
+        for future in concurrent.futures.as_completed(futures):
+            user = futures[future]
+            counts["users"] += 1
+            try:
+                changes = future.result()
+            except Exception as e:
+                counts["failed"] += 1
+                change = {"user": user, "action": "fetch", "resource_type": None, "current": None, "desired": None,
+                          "status": "failed", "message": "error: {0}".format(e)}
+                renderer.render("sync_change", change, error=True)
+                if sync_journal is not None:
+                    sync_journal.record(user_key(user), "failed", str(e))
+                continue
+            for change in changes:
+                counts[change["status"]] += 1
+                renderer.render("sync_change", change, error=change["status"] in ["failed", "skipped"])
+            if sync_journal is not None:
+                failed = any(change["status"] == "failed" for change in changes)
+                sync_journal.record(user_key(user), "failed" if failed else "done")
+
+        renderer.message("{0} users checked; {1} changes {2}, {3} failed, {4} skipped; {5} users already done".format(
+            counts["users"], counts["planned"] if args.dry_run else counts["applied"],
+            "planned" if args.dry_run else "applied", counts["failed"], counts["skipped"], len(desired) - len(users)
+        ))
+    if counts["failed"] > 0:
+        sys.exit(1)
+
+def collect_usernames(args):
+    """
+    Returns the distinct usernames given by the --users options, each of which contains a comma-separated list of
+    usernames, followed by the usernames listed in the file given by --users-file.
+    """
+    usernames = []
+    for users in args.users or []:
+        usernames.extend(u.strip() for u in users.split(",") if u.strip() != "")
+    if args.users_file is not None:
+        usernames.extend(read_usernames(args.users_file))
+    return list(dict.fromkeys(usernames))
+
+def subscription_values(subscription):
+    """
+    Extracts the values that the watch subcommand compares from a subscription: the plan name and the quota and usage
+    for each resource type.
+    """
+    values = {"plan": (subscription.get("plan") or {}).get("name")}
+    for q in subscription.get("quotas") or []:
+        values[("quota", q["resource_type"]["name"])] = q["quota"]
+    for u in subscription.get("usages") or []:
+        values[("usage", u["resource_type"]["name"])] = u["usage"]
+    return values
+
+def diff_subscription_values(user, previous, current, threshold, alerted):
+    """
+    Compares the values extracted from two versions of a user's subscription and returns the watch events describing
+    the differences. An alert is raised when the usage for a resource type reaches the threshold fraction of its quota;
+    alerted is the set of (user, resource type) pairs with outstanding alerts, so that each alert is only raised once
+    until the usage falls below the threshold again. If previous is None, only alerts are returned.
+    """
+    now = time.strftime("%Y-%m-%dT%H:%M:%S")
+    event = lambda kind, resource_type, before, after, message=None: {
+        "time": now, "user": user, "event": kind, "resource_type": resource_type, "previous": before,
+        "current": after, "message": message,
+    }
+    events = []
+    if previous is not None:
+        if previous["plan"] != current["plan"]:
+            events.append(event("plan", None, previous["plan"], current["plan"]))
+        for key in sorted(set(previous) | set(current), key=str):
+            if key != "plan" and previous.get(key) != current.get(key):
+                events.append(event(key[0], key[1], previous.get(key), current.get(key)))
+
+    resource_types = {key[1] for key in current if key != "plan"}
+    for resource_type in sorted(resource_types):
+        quota, used = current.get(("quota", resource_type)), current.get(("usage", resource_type))
+        ratio = usage.usage_ratio(used or 0, quota or 0)
+        if ratio >= threshold and (user, resource_type) not in alerted:
+            alerted.add((user, resource_type))
+            message = "{0} usage is at {1:.0%} of the quota ({2} of {3})".format(resource_type, ratio, used, quota)
+            events.append(event("alert", resource_type, None, None, message))
+        elif ratio < threshold:
+            alerted.discard((user, resource_type))
+    return events
+
+def poll_subscription(environment, user, state):
+    """
+    Polls a user's subscription for the watch subcommand. The request is conditional, so an unchanged subscription
+    normally costs an empty response, and the response is only decoded if its body differs from the previous one.
+    Returns the values extracted from the subscription, or None if they haven't changed.
+    """
+    content, state["validators"] = client.admin_get_subscription_if_changed(environment, user, state["validators"])
+    if content is None or content == state["content"]:
+        return None
+    state["content"] = content
+    return subscription_values(json.loads(content)["result"])
+
+def watch_subscriptions(args):
+    """
+    Polls the subscriptions of a set of users on an interval and reports changes to their plans, quotas and usages as
+    they happen, along with alerts when a user's usage reaches a threshold fraction of a quota. All requests share the
+    client's pooled keep-alive connections and are conditional, so users whose subscriptions haven't changed are cheap
+    to poll. The command runs until it's interrupted, or for a fixed number of polls. Administrative access is required
+    to use this subcommand.
+    """
+    usernames = collect_usernames(args)
+    if len(usernames) == 0:
+        print("no users to watch; use --users or --users-file", file=sys.stderr)
+        sys.exit(1)
+    if args.interval <= 0:
+        print("invalid interval:", args.interval, file=sys.stderr)
+        sys.exit(1)
+
+    prepare_workers(args)
+
+    states = {user: {"validators": None, "content": None, "values": None, "error": None} for user in usernames}
+    alerted = set()
+    polls = 0
+    with renderers.get_renderer(args.output) as renderer, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        renderer.message("watching {0} users every {1} seconds; press Ctrl-C to stop".format(
+            len(usernames), args.interval
+        ))
+        try:
+            while True:
+                started = time.monotonic()
+                futures = {executor.submit(poll_subscription, args.env, user, states[user]): user for user in states}
+                for future in concurrent.futures.as_completed(futures):
+                    user, state = futures[future], states[futures[future]]
+                    try:
+                        values = future.result()
+                        state["error"] = None
+                    except Exception as e:
+                        # Only report an error when it changes so that an outage doesn't flood the output.
+                        if str(e) != state["error"]:
+                            state["error"] = str(e)
+                            renderer.render("watch_event", {
+                                "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "user": user, "event": "error",
+                                "resource_type": None, "previous": None, "current": None, "message": str(e),
+                            }, error=True)
+                        continue
+                    if values is None:
+                        continue
+                    for event in diff_subscription_values(user, state["values"], values, args.threshold, alerted):
+                        renderer.render("watch_event", event)
+                    state["values"] = values
+
+                polls += 1
+                if args.count is not None and polls >= args.count:
+                    break
+                time.sleep(max(0, args.interval - (time.monotonic() - started)))
+        except KeyboardInterrupt:
+            pass
+
+# The categories of information compared by the compare subcommand, in the order in which differences are displayed.
+comparison_categories = ["resource_type", "plan", "user"]
+
+def comparison_fields(category, item, usages=False):
+    """
+    Extracts the values that the compare subcommand compares from a resource type, a plan or a user's subscription. The
+    usages in a subscription are only included if requested, because they're expected to differ between environments.
+    """
+    if category == "resource_type":
+        return {"unit": item["unit"]}
+    if category == "plan":
+        return {
+            "quota_default.{0}".format(qd["resource_type"]["name"]): qd["quota_value"]
+            for qd in item["plan_quota_defaults"]
+        }
+    return {
+        key if key == "plan" else "{0}.{1}".format(*key): value
+        for key, value in subscription_values(item).items() if usages or key == "plan" or key[0] != "usage"
+    }
+
+def diff_environments(envs, data, failed):
+    """
+    Compares the information fetched from several environments and returns the differences. The data for each
+    environment maps (category, name) pairs to the values extracted by comparison_fields, and failed contains an
+    (environment, category, name) triple for each fetch that failed, with a name of None for a catalog. Environments
+    are left out of any comparison that their failures make meaningless.
+    """
+    differences = []
+    order = lambda key: (comparison_categories.index(key[0]), key[1])
+    for category, name in sorted(set().union(*(data[env] for env in envs)), key=order):
+        compared = [
+            env for env in envs if (env, category, None) not in failed and (env, category, name) not in failed
+        ]
+        if len(compared) < 2:
+            continue
+        difference = lambda field, values: {"category": category, "name": name, "field": field, "values": values}
+        if any((category, name) not in data[env] for env in compared):
+            differences.append(difference(None, {env: (category, name) in data[env] for env in compared}))
+            continue
+        fields = set().union(*(data[env][(category, name)] for env in compared))
+        for field in sorted(fields):
+            values = {env: data[env][(category, name)].get(field) for env in compared}
+            if any(value != values[compared[0]] for value in values.values()):
+                differences.append(difference(field, values))
+    return differences
+
+def compare_environments(args):
+    """
+    Compares the resource types, plans and, optionally, the subscriptions of a set of users in two or more environments
+    and displays the differences. Each environment has its own access token, connection pool and throttle, and the
+    requests for all of the environments are sent concurrently, so the comparison takes about as long as fetching the
+    information from the slowest environment. Administrative access to every environment is required to compare user
+    subscriptions.
+    """
+    envs = args.envs
+    if len(envs) < 2:
+        print("at least two environments are required; for example, use --env qa,prod", file=sys.stderr)
+        sys.exit(1)
+    usernames = collect_usernames(args)
+
+    # Prepare each environment up front, one at a time, so that login prompts aren't interleaved.
+    for env in envs:
+        prepare_workers(args, env)
+
+    # Interleave the requests for the environments so that each one keeps about args.concurrency requests in flight.
+    tasks = [("resource_type", None, client.list_resource_types), ("plan", None, client.list_plans)]
+    tasks += [("user", user, client.admin_get_subscription) for user in usernames]
+    data = {env: {} for env in envs}
+    failed = set()
+    with renderers.get_renderer(args.output) as renderer, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency * len(envs)) as executor:
+        futures = {}
+        for category, name, fetch in tasks:
+            for env in envs:
+                arguments = [env] if name is None else [env, name]
+                futures[executor.submit(fetch, *arguments)] = (env, category, name)
+        for future in concurrent.futures.as_completed(futures):
+            env, category, name = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # A user who doesn't exist in an environment is reported as a difference rather than an error.
+                if name is not None and client.is_not_found_error(e):
+                    continue
+                failed.add((env, category, name))
+                renderer.render("comparison", {
+                    "category": category, "name": name if name is not None else "catalog", "field": "error",
+                    "values": {env: str(e)},
+                }, error=True)
+                continue
+            for item in [result] if name is not None else result:
+                key = (category, name if name is not None else item["name"])
+                data[env][key] = comparison_fields(category, item, args.usages)
+
+        differences = diff_environments(envs, data, failed)
+        for difference in differences:
+            renderer.render("comparison", difference)
+
+        # Users who don't exist in any environment have nothing to compare, which usually means a misspelled username.
+        missing = [
+            user for user in usernames
+            if all(("user", user) not in data[env] and (env, "user", user) not in failed for env in envs)
+        ]
+        for user in missing:
+            renderer.render("comparison", {
+                "category": "user", "name": user, "field": None, "values": {env: False for env in envs},
+            }, error=True)
+
+        counts = {category: len({key for env in envs for key in data[env] if key[0] == category})
+                  for category in comparison_categories}
+        renderer.message("compared {0} resource types, {1} plans and {2} users in {3}: {4} differences, {5} errors, "
+                         "{6} users not found".format(counts["resource_type"], counts["plan"], counts["user"],
+                                                      ", ".join(envs), len(differences), len(failed), len(missing)))
+    if len(failed) > 0 or len(missing) > 0:
+        sys.exit(1)
 
 def display_module_help(args):
     """
@@ -170,6 +1150,30 @@ def display_module_help(args):
     print("information about the currently active subscription of the specified user will be")
     print("displayed.")
     print()
+    print(prog, args.command, "get --users-file path [--concurrency n] [--timeout seconds]")
+    print()
+    print("options:")
+    print("  --users-file path")
+    print("                        a file containing one username per line, or - for standard input")
+    print("  --concurrency n, -c n")
+    print("                        the maximum number of requests to send at the same time (default: 16)")
+    print("  --timeout seconds")
+    print("                        the timeout for each request (default: 60)")
+    print()
+    print("Gets information about the currently active subscription of each user listed in a file.")
+    print("The requests are sent concurrently and each subscription is displayed as soon as it's")
+    print("received. Admin access is required to use this command.")
+    print()
+    print(prog, args.command, "get --offline (--user username | --users-file path) [--snapshot path]")
+    print()
+    print("options:")
+    print("  --offline")
+    print("                        read the subscriptions from the local snapshot instead of Terrain")
+    print("  --snapshot path")
+    print("                        the snapshot file (default: $HOME/.terrain-snapshot-{env}.db)")
+    print()
+    print("Displays subscriptions stored by the snapshot command without contacting Terrain.")
+    print()
     print(prog, args.command, "add --user username --plan plan")
     print(prog, args.command, "add -u username -p plan")
     print()
@@ -192,17 +1196,161 @@ def display_module_help(args):
     print("  --resource-type resource-type, -r resource-type")
     print("                        the name of the resource type to update the quota for")
     print("  --quota quota, -q quota")
-    print("                        the new resource usage limit")
+    print("                        the new resource usage limit, such as 10T, 90min or +10%")
     print()
     print("Updates a quota in the user's currently active subscription plan. If the user doesn't have")
     print("an active subscription, a new subscription of the default type will be created and the quota")
     print("will be updated in the new subscription. If the subscription plan doesn't have a quota for the")
     print("specified resource type then a new quota for the specified resource type will be added.")
     print()
+    print(prog, args.command, "bulk-apply --file manifest.csv [--format csv|jsonl] [--concurrency n]")
+    print("        [--journal path] [--resume] [--max-attempts n]")
+    print(prog, args.command, "bulk-apply -f manifest.csv [-c n]")
+    print()
+    print("options:")
+    print("  --file path, -f path")
+    print("                        the path to the CSV or JSONL manifest to apply")
+    print("  --format format")
+    print("                        the manifest format; determined from the file extension by default")
+    print("  --concurrency n, -c n")
+    print("                        the maximum number of rows to process at the same time (default: 8)")
+    print("  --journal path")
+    print("                        where to record completed rows (default: the manifest path + .journal)")
+    print("  --resume")
+    print("                        skip the rows that the journal records as already applied")
+    print("  --max-attempts n")
+    print("                        the number of times to try each row if Terrain is unavailable (default: 3)")
+    print()
+    print("Applies subscription plans and quotas to the users listed in a manifest. Each row may contain")
+    print("the columns user, plan, resource_type and quota. If a plan is specified, the user is subscribed")
+    print("to that plan. If a resource type and quota are specified, the quota is updated. The result for")
+    print("each row is displayed as it completes. Admin access is required to use this command.")
+    print()
+    print("The outcome of each row is recorded in a journal. If a run is interrupted, or some rows fail,")
+    print("running the command again with --resume applies only the rows that haven't succeeded yet.")
+    print()
+    print(prog, args.command, "report --users-file path [--top n] [--plan plan] [--concurrency n] [--timeout seconds]")
+    print(prog, args.command, "report --offline [--users-file path] [--top n] [--plan plan] [--snapshot path]")
+    print()
+    print("options:")
+    print("  --users-file path")
+    print("                        a file containing one username per line, or - for standard input")
+    print("  --top n")
+    print("                        the number of users closest to their quotas to list (default: 10)")
+    print("  --plan plan, -p plan")
+    print("                        only include users subscribed to this plan")
+    print("  --concurrency n, -c n")
+    print("                        the maximum number of requests to send at the same time (default: 16)")
+    print("  --timeout seconds")
+    print("                        the timeout for each request (default: 60)")
+    print()
+    print("Reports usage relative to quotas for each resource type across all of the users listed in a")
+    print("file. The report includes totals, usage ratio percentiles and the users who are closest to")
+    print("their quotas. Admin access is required to use this command. With --offline, the report")
+    print("is built from the local snapshot, and every user in it is included if no users file is given.")
+    print()
+    print(prog, args.command, "snapshot [--users-file path] [--max-age seconds] [--full] [--snapshot path]")
+    print("        [--concurrency n] [--timeout seconds]")
+    print()
+    print("options:")
+    print("  --users-file path")
+    print("                        a file containing one username per line, or - for standard input")
+    print("  --max-age seconds")
+    print("                        fetch subscriptions stored longer ago than this (default: 3600)")
+    print("  --full")
+    print("                        fetch every subscription, regardless of its age")
+    print("  --snapshot path")
+    print("                        the snapshot file (default: $HOME/.terrain-snapshot-{env}.db)")
+    print("  --concurrency n, -c n")
+    print("                        the maximum number of requests to send at the same time (default: 16)")
+    print("  --timeout seconds")
+    print("                        the timeout for each request (default: 60)")
+    print()
+    print("Stores the subscriptions of the users listed in a file in a local SQLite snapshot, which")
+    print("get --offline and report --offline can use without contacting Terrain. Only subscriptions")
+    print("that are missing from the snapshot or older than the maximum age are fetched. Without a")
+    print("users file, the users already in the snapshot are refreshed. Admin access is required to")
+    print("use this command.")
+    print()
+    print(prog, args.command, "watch --users user1,user2 [--users-file path] [--interval seconds]")
+    print("        [--threshold fraction] [--count n] [--concurrency n]")
+    print()
+    print("options:")
+    print("  --users user1,user2")
+    print("                        a comma-separated list of users to watch; may be repeated")
+    print("  --users-file path")
+    print("                        a file containing one username per line, or - for standard input")
+    print("  --interval seconds, -i seconds")
+    print("                        the time between polls (default: 30)")
+    print("  --threshold fraction, -t fraction")
+    print("                        alert when usage reaches this fraction of a quota (default: 0.9)")
+    print("  --count n, -n n")
+    print("                        stop after n polls instead of running until interrupted")
+    print("  --concurrency n, -c n")
+    print("                        the maximum number of requests to send at the same time (default: 8)")
+    print()
+    print("Polls the subscriptions of the listed users and displays changes to their plans, quotas")
+    print("and usages, along with an alert when a user's usage reaches the threshold. Requests are")
+    print("conditional where Terrain supports it, so unchanged subscriptions are cheap to poll. Admin")
+    print("access is required to use this command.")
+    print()
+    print(prog, "--env qa,prod", args.command, "compare [--users user1,user2] [--users-file path] [--usages]")
+    print("        [--concurrency n]")
+    print()
+    print("options:")
+    print("  --users user1,user2")
+    print("                        a comma-separated list of users whose subscriptions to compare; may be repeated")
+    print("  --users-file path")
+    print("                        a file containing one username per line, or - for standard input")
+    print("  --usages")
+    print("                        also compare the users' usages, which normally differ between environments")
+    print("  --concurrency n, -c n")
+    print("                        the maximum number of requests to send to each environment at the same time")
+    print("                        (default: 8)")
+    print()
+    print("Compares the resource types, plans and the listed users' subscriptions in two or more")
+    print("environments, selected using the root --env option, and displays the differences. The")
+    print("environments are queried at the same time. Admin access to every environment is required to")
+    print("compare subscriptions.")
+    print()
+    print(prog, args.command, "sync --desired policy.yaml [--dry-run] [--concurrency n]")
+    print("        [--journal path] [--resume] [--max-attempts n]")
+    print()
+    print("options:")
+    print("  --desired path, -d path")
+    print("                        the YAML or JSON file describing the desired plans and quotas")
+    print("  --dry-run, -n")
+    print("                        display the changes that would be made without making them")
+    print("  --concurrency n, -c n")
+    print("                        the maximum number of users to process at the same time (default: 8)")
+    print("  --journal path")
+    print("                        where to record completed users (default: the policy path + .journal)")
+    print("  --resume")
+    print("                        skip the users that the journal records as already in sync")
+    print("  --max-attempts n")
+    print("                        the number of times to try each request if Terrain is unavailable (default: 3)")
+    print()
+    print("Compares the current subscriptions of the users listed in a policy file to the plans and")
+    print("quotas in the file and sends only the updates that change something. Admin access is")
+    print("required to use this command. Unless --dry-run is used, the users that were brought in line")
+    print("with the policy are recorded in a journal so that --resume can skip them in a later run.")
+    print()
     print(prog, args.command, "help")
     print()
     print("Display this help message.")
 
+def positive_int(value):
+    """
+    Converts a command-line argument to a positive integer.
+    """
+    try:
+        result = int(value)
+    except ValueError:
+        result = 0
+    if result < 1:
+        raise argparse.ArgumentTypeError("invalid positive integer: '{0}'".format(value))
+    return result
+
 def config_argument_parser(parser):
     """
     Configures the argument parser for the module.
@@ -219,7 +1367,13 @@ def config_argument_parser(parser):
 
     # Displays the current subscription for a user.
     parser_get_subscription = subparsers.add_parser("get")
-    parser_get_subscription.add_argument("-u", "--user")
+    users_group = parser_get_subscription.add_mutually_exclusive_group()
+    users_group.add_argument("-u", "--user")
+    users_group.add_argument("--users-file")
+    parser_get_subscription.add_argument("-c", "--concurrency", type=positive_int, default=16)
+    parser_get_subscription.add_argument("--timeout", type=float, default=60)
+    parser_get_subscription.add_argument("--offline", action="store_true")
+    parser_get_subscription.add_argument("--snapshot")
     parser_get_subscription.set_defaults(func=get_subscription)
 
     # Creates a new subscription for a user.
@@ -235,6 +1389,65 @@ def config_argument_parser(parser):
     parser_set_quota.add_argument("-q", "--quota",required=True)
     parser_set_quota.set_defaults(func=set_quota)
 
+    # Applies subscriptions and quotas from a manifest.
+    parser_bulk_apply = subparsers.add_parser("bulk-apply")
+    parser_bulk_apply.add_argument("-f", "--file", required=True)
+    parser_bulk_apply.add_argument("--format", choices=["csv", "jsonl"])
+    parser_bulk_apply.add_argument("-c", "--concurrency", type=positive_int, default=8)
+    parser_bulk_apply.add_argument("--journal")
+    parser_bulk_apply.add_argument("--resume", action="store_true")
+    parser_bulk_apply.add_argument("--max-attempts", type=positive_int, default=3)
+    parser_bulk_apply.set_defaults(func=bulk_apply)
+
+    # Reports usage relative to quotas across many users.
+    parser_report = subparsers.add_parser("report")
+    parser_report.add_argument("--users-file")
+    parser_report.add_argument("--top", type=int, default=10)
+    parser_report.add_argument("-c", "--concurrency", type=positive_int, default=16)
+    parser_report.add_argument("--timeout", type=float, default=60)
+    parser_report.add_argument("-p", "--plan")
+    parser_report.add_argument("--offline", action="store_true")
+    parser_report.add_argument("--snapshot")
+    parser_report.set_defaults(func=usage_report)
+
+    # Stores subscriptions in the local snapshot.
+    parser_snapshot = subparsers.add_parser("snapshot")
+    parser_snapshot.add_argument("--users-file")
+    parser_snapshot.add_argument("--snapshot")
+    parser_snapshot.add_argument("--max-age", type=float, default=3600)
+    parser_snapshot.add_argument("--full", action="store_true")
+    parser_snapshot.add_argument("-c", "--concurrency", type=positive_int, default=16)
+    parser_snapshot.add_argument("--timeout", type=float, default=60)
+    parser_snapshot.set_defaults(func=take_snapshot)
+
+    # Watches subscriptions for changes.
+    parser_watch = subparsers.add_parser("watch")
+    parser_watch.add_argument("--users", action="append")
+    parser_watch.add_argument("--users-file")
+    parser_watch.add_argument("-i", "--interval", type=float, default=30)
+    parser_watch.add_argument("-t", "--threshold", type=float, default=0.9)
+    parser_watch.add_argument("-n", "--count", type=int)
+    parser_watch.add_argument("-c", "--concurrency", type=positive_int, default=8)
+    parser_watch.set_defaults(func=watch_subscriptions)
+
+    # Compares environments.
+    parser_compare = subparsers.add_parser("compare")
+    parser_compare.add_argument("--users", action="append")
+    parser_compare.add_argument("--users-file")
+    parser_compare.add_argument("--usages", action="store_true")
+    parser_compare.add_argument("-c", "--concurrency", type=positive_int, default=8)
+    parser_compare.set_defaults(func=compare_environments, multiple_environments=True)
+
+    # Brings subscriptions in line with a desired-state policy.
+    parser_sync = subparsers.add_parser("sync")
+    parser_sync.add_argument("-d", "--desired", required=True)
+    parser_sync.add_argument("-n", "--dry-run", action="store_true")
+    parser_sync.add_argument("-c", "--concurrency", type=positive_int, default=8)
+    parser_sync.add_argument("--journal")
+    parser_sync.add_argument("--resume", action="store_true")
+    parser_sync.add_argument("--max-attempts", type=positive_int, default=3)
+    parser_sync.set_defaults(func=sync_subscriptions)
+
     # Displays the help for this module.
     parser_show_help = subparsers.add_parser("help")
     parser_show_help.set_defaults(func=display_module_help)
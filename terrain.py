@@ -2,23 +2,82 @@
 
 import argparse
 import os
-import pprint
 import subcommands
-import subscriptions
 import sys
 
 GREEN="\033[92m"
 NORMAL="\033[0m"
 
-def add_subparser_for_module(subparsers, module):
+# The output formats supported by the renderers module. These are listed here so that the renderers don't have to be
+# loaded just to build the argument parser.
+output_formats = ["table", "json", "ndjson", "csv"]
+
+def add_subparser_for_module(subparsers, entry, selected):
     """
-    Adds an argument subparser for a module.
+    Adds an argument subparser for a module. The module is only imported and its arguments are only configured if one
+    of its subcommands was selected on the command line.
     """
-    subcommand, *aliases = module.list_module_subcommands()
-    description = module.get_module_description()
-    subcommands.add_subcommand_description(subcommand, aliases, description)
+    subcommand, aliases, description = entry["subcommand"], entry["aliases"], entry["description"]
     parser = subparsers.add_parser(subcommand, aliases=aliases, description=description)
-    module.config_argument_parser(parser)
+    if selected is not None and selected in [subcommand] + aliases:
+        subcommands.load_subcommand_module(entry).config_argument_parser(parser)
+
+def add_global_arguments(parser):
+    """
+    Adds the arguments that are accepted before the subcommand name.
+    """
+    parser.add_argument(
+        "-e", "--env",
+        help="the DE environment to work with: {0} (default: prod); subcommands that compare environments accept "
+             "several, either comma-separated or by repeating the option".format(", ".join(subcommands.environments)),
+        action="append"
+    )
+    parser.add_argument(
+        "-o", "--output",
+        help="the output format",
+        choices=output_formats,
+        default="table"
+    )
+    parser.add_argument(
+        "--no-cache",
+        help="do not read or write the local catalog cache",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--refresh",
+        help="ignore cached catalog information and fetch it from Terrain again",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        help="the number of seconds for which cached catalog information is used (default: 3600)",
+        type=int,
+        default=3600
+    )
+    parser.add_argument(
+        "--trace",
+        help="display a summary of the time spent on requests to Terrain when the command completes",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--trace-file",
+        help="write a JSON timeline of the requests sent to Terrain to this file"
+    )
+    parser.add_argument(
+        "--profile",
+        help="write cProfile statistics for the command to this file"
+    )
+
+def selected_subcommand(argv):
+    """
+    Determines which subcommand was selected on the command line without configuring any subcommand modules.
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    add_global_arguments(parser)
+    parser.add_argument("command", nargs="?")
+    parser.add_argument("arguments", nargs=argparse.REMAINDER)
+    args, _ = parser.parse_known_args(argv)
+    return args.command
 
 def parse_args():
     """
@@ -28,26 +87,59 @@ def parse_args():
         "Terrain API Client",
         description="Use {0}{1} help{2} to list available subcommands.".format(GREEN, sys.argv[0], NORMAL)
     )
-    parser.add_argument(
-        "-e", "--env",
-        help="the DE environment to work with",
-        choices=["prod", "qa"],
-        default="prod"
-    )
+    add_global_arguments(parser)
     subparsers = parser.add_subparsers(metavar="subcommand", dest="command")
 
-    # Add subparsers and keep a record of the available subcommands.
-    add_subparser_for_module(subparsers, subscriptions)
+    # Add a subparser for each registered subcommand module. Installed packages are only scanned for additional modules
+    # if the selected subcommand isn't built in.
+    selected = selected_subcommand(sys.argv[1:])
+    for entry in subcommands.registered_modules(selected):
+        add_subparser_for_module(subparsers, entry, selected)
     subcommands.add_subcommand_subparser(subparsers)
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    subcommands.select_environments(parser, args)
+    return args
 
 if __name__ == "__main__":
-    # Enable ANSI escape codes in the terminal.
-    os.system("")
+    # Enable ANSI escape codes in the Windows console. Other terminals support them already.
+    if os.name == "nt":
+        os.system("")
 
     # Parse the command-line arguments.
     args = parse_args()
 
-    # Call the subcommand function.
-    args.func(args)
+    # Configure the catalog cache if the selected subcommand talks to Terrain. The client module is only loaded by the
+    # subcommand modules that need it.
+    client = sys.modules.get("client")
+    if client is not None:
+        client.configure_cache(ttl=args.cache_ttl, enabled=not args.no_cache, refresh=args.refresh)
+
+    # Start recording request timings and profiling if requested. These modules are only loaded when they're needed.
+    # Subcommands that run other commands, such as the shell, report the timings for each command themselves.
+    tracer = None
+    if (args.trace or args.trace_file is not None) and not getattr(args, "traces_commands", False):
+        import timing
+        tracer = timing.Tracer()
+        tracer.install()
+    profiler = None
+    if args.profile is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    # Call the subcommand function. If the output is piped into a command that exits early, such as head, the rest of
+    # the output is discarded so that Python doesn't report the closed pipe again when it flushes standard output at
+    # exit.
+    try:
+        args.func(args)
+    except BrokenPipeError:
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        sys.exit(1)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if tracer is not None:
+            tracer.report(args.trace, args.trace_file)
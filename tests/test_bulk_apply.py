@@ -0,0 +1,118 @@
+import json
+import os.path
+import subprocess
+import sys
+
+import pytest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(root, "benchmarks"))
+
+import mock_terrain
+
+@pytest.fixture
+def terrain(tmp_path):
+    """
+    Starts a mock Terrain server with a small number of users and a little jitter, so that concurrent requests complete
+    out of order.
+    """
+    mock = mock_terrain.MockTerrain(users=10, latency=0.005, jitter=0.02)
+    server = mock_terrain.start_server(mock)
+    (tmp_path / ".terrain-qa").write_text(mock_terrain.make_token("admin", 3600) + "\n")
+    mock.url = "http://127.0.0.1:{0}".format(server.server_port)
+    yield mock
+    server.shutdown()
+    server.server_close()
+
+def bulk_apply(terrain, tmp_path, manifest, *options):
+    """
+    Runs bulk-apply against the mock server and returns the completed process.
+    """
+    env = dict(os.environ, HOME=str(tmp_path), TERRAIN_QA_URL=terrain.url, TERRAIN_QA_RATE_LIMIT="0")
+    env.pop("TERRAIN_USERNAME", None)
+    env.pop("TERRAIN_PASSWORD", None)
+    command = [sys.executable, os.path.join(root, "terrain.py"), "-e", "qa", "-o", "ndjson", "subscriptions",
+               "bulk-apply", "-f", str(manifest), "-c", "8"] + list(options)
+    return subprocess.run(command, env=env, capture_output=True, text=True, timeout=60)
+
+def results(process):
+    return sorted((json.loads(line) for line in process.stdout.splitlines()), key=lambda r: r["line"])
+
+def quotas(subscription):
+    return {q["resource_type"]["name"]: q["quota"] for q in subscription["quotas"]}
+
+def test_rows_for_the_same_user_are_applied_in_manifest_order(terrain, tmp_path):
+    manifest = tmp_path / "manifest.csv"
+    rows = ["user,plan,resource_type,quota"]
+    for i in range(1, 9):
+        rows += [
+            "user{0},Pro,,".format(i),
+            "user{0},,data.size,1G".format(i),
+            "user{0},Regular,,".format(i),
+            "user{0},,cpu.hours,quota+{1}".format(i, i),
+        ]
+    manifest.write_text("\n".join(rows) + "\n")
+
+    process = bulk_apply(terrain, tmp_path, manifest)
+    assert process.returncode == 0, process.stderr
+    assert all(r["status"] == "succeeded" for r in results(process))
+    for i in range(1, 9):
+        subscription = terrain.subscriptions["user{0}".format(i)]
+        assert subscription["plan"]["name"] == "Regular"
+        assert quotas(subscription) == {"cpu.hours": 100.0 + i, "data.size": 53687091200.0}
+
+def test_rows_that_fail_validation_are_reported(terrain, tmp_path):
+    manifest = tmp_path / "manifest.jsonl"
+    manifest.write_text("\n".join([
+        '{"user": "user1", "plan": "Pro"}',
+        '{"user": "user2", "plan": "Platinum"}',
+        '{"user": "user3", "resource_type": "gpu.hours", "quota": "10"}',
+        '{"user": "user4", "resource_type": "data.size"}',
+        '{"plan": "Pro"}',
+        '{"user": "user5", "resource_type": "data.size", "quota": "10 parsecs"}',
+        'not json',
+        '["user6"]',
+        '{"user": "ghost", "plan": "Pro"}',
+        '{"user": "user7", "resource_type": "data.size", "quota": "2T"}',
+    ]) + "\n")
+
+    process = bulk_apply(terrain, tmp_path, manifest)
+    assert process.returncode == 1
+    by_line = {r["line"]: r for r in results(process)}
+    assert [line for line, r in sorted(by_line.items()) if r["status"] == "succeeded"] == [1, 10]
+    assert by_line[2]["message"] == "plan does not exist: Platinum"
+    assert by_line[3]["message"] == "resource type does not exist: gpu.hours"
+    assert by_line[4]["message"] == "resource_type and quota must be specified together"
+    assert by_line[5]["message"] == "no user specified"
+    assert by_line[6]["message"].startswith("invalid quota specification")
+    assert by_line[7]["message"].startswith("invalid JSON")
+    assert by_line[8]["message"] == "invalid row: expected a JSON object"
+    assert by_line[9]["message"] == "error: user does not exist: ghost"
+    assert "2 succeeded, 8 failed, 0 already done" in process.stderr
+    assert terrain.subscriptions["user1"]["plan"]["name"] == "Pro"
+    assert quotas(terrain.subscriptions["user7"])["data.size"] == 2 * 2**40
+
+def test_csv_manifest_with_byte_order_mark(terrain, tmp_path):
+    manifest = tmp_path / "manifest.csv"
+    manifest.write_bytes("user,plan\nuser1,Pro\n".encode("utf-8-sig"))
+    process = bulk_apply(terrain, tmp_path, manifest)
+    assert process.returncode == 0, process.stdout + process.stderr
+    assert terrain.subscriptions["user1"]["plan"]["name"] == "Pro"
+
+def test_resume_skips_rows_that_already_succeeded(terrain, tmp_path):
+    manifest = tmp_path / "manifest.csv"
+    manifest.write_text("user,plan\nuser1,Pro\nlate,Pro\nuser2,Regular\n")
+
+    process = bulk_apply(terrain, tmp_path, manifest)
+    assert process.returncode == 1
+    assert "2 succeeded, 1 failed, 0 already done" in process.stderr
+
+    # The failed row succeeds once the user exists; the rows that already succeeded aren't sent again.
+    terrain.subscribe("late", "Basic")
+    terrain.reset_counts()
+    process = bulk_apply(terrain, tmp_path, manifest, "--resume")
+    assert process.returncode == 0, process.stderr
+    assert [(r["line"], r["user"]) for r in results(process)] == [(3, "late")]
+    assert "1 succeeded, 0 failed, 2 already done" in process.stderr
+    assert terrain.reset_counts().get("PUT /admin/qms/users/{user}/plan/{name}") == 1
+    assert terrain.subscriptions["late"]["plan"]["name"] == "Pro"
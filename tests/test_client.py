@@ -0,0 +1,157 @@
+import json
+import pytest
+import client
+
+def split_every(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+document = json.dumps({
+    "total": 3,
+    "note": "not the array: ]",
+    "subjects": [
+        {"id": "ipcdev", "name": "Ïpç Dëv", "tags": ["a", "]"]},
+        {"id": "ünïcode", "email": "snow☃@example.org"},
+        17,
+        "text with \"quotes\" and ]",
+        {"id": "last"},
+    ],
+    "after": {"ignored": True},
+}, ensure_ascii=False).encode("utf-8")
+
+expected = json.loads(document)["subjects"]
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 64, len(document)])
+def test_iter_json_array_chunk_boundaries(size):
+    assert list(client.iter_json_array(split_every(document, size), "subjects")) == expected
+
+def test_iter_json_array_splits_every_position():
+    for i in range(1, len(document)):
+        assert list(client.iter_json_array([document[:i], document[i:]], "subjects")) == expected
+
+def test_iter_json_array_numbers_split_across_chunks():
+    assert list(client.iter_json_array([b'{"subjects": [1, 2', b'3, 4', b'5]}'], "subjects")) == [1, 23, 45]
+
+def test_iter_json_array_empty():
+    assert list(client.iter_json_array([b'{"subjects": [', b' ]}'], "subjects")) == []
+
+def test_iter_json_array_missing_array():
+    with pytest.raises(ValueError, match="missing or truncated"):
+        list(client.iter_json_array([b'{"groups": [1, 2]}'], "subjects"))
+
+def test_iter_json_array_truncated_array():
+    elements = client.iter_json_array([b'{"subjects": [{"id": "a"}, {"id": "b'], "subjects")
+    assert next(elements) == {"id": "a"}
+    with pytest.raises(ValueError, match="missing or truncated"):
+        next(elements)
+
+class FakeResponse:
+    """
+    A streamed response to a /subjects search that records how many bytes were read.
+    """
+
+    def __init__(self, ids, filler=0, chunk_size=1024):
+        subjects = []
+        for subject_id in ids:
+            subjects.append({"id": subject_id} if subject_id is not None else {"id": "filler", "pad": "x" * filler})
+        self.body = json.dumps({"subjects": subjects}).encode("utf-8")
+        self.chunk_size = chunk_size
+        self.read = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for chunk in split_every(self.body, self.chunk_size):
+            self.read += len(chunk)
+            yield chunk
+
+class FakeClient:
+    """
+    Returns the configured response for each /subjects search and records the searches.
+    """
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.searches = []
+
+    def get(self, path, params=None, stream=False):
+        self.searches.append(params["search"])
+        return self.responses[params["search"]]
+
+@pytest.fixture
+def fake_client(monkeypatch, tmp_path):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setattr(client, "catalog_caches", {})
+    client.configure_cache(enabled=False)
+    fake = FakeClient({})
+    monkeypatch.setattr(client, "get_client", lambda environment: fake)
+    return fake
+
+def test_several_pending_names_resolved_by_one_search(fake_client):
+    fake_client.responses["alice"] = FakeResponse(["alice", "alicea", "bob", "carol"])
+    validator = client.SubjectValidator("qa")
+    assert validator.validate(["alice", "bob", "carol", "alice"], concurrency=1) == {
+        "alice": True, "bob": True, "carol": True,
+    }
+    assert fake_client.searches == ["alice"]
+
+def test_name_missing_from_search_results_is_invalid(fake_client):
+    fake_client.responses["ghost"] = FakeResponse(["ghostly", "ghostwriter"])
+    assert client.SubjectValidator("qa").validate(["ghost"]) == {"ghost": False}
+
+def test_exact_match_past_drain_limit(fake_client):
+    limit = client.SubjectValidator.drain_limit
+    response = FakeResponse(["alice", None, "bob", "carol"], filler=limit * 2)
+    fake_client.responses["carol"] = response
+    fake_client.responses["alice"] = response
+    fake_client.responses["bob"] = FakeResponse(["bob"])
+    validator = client.SubjectValidator("qa")
+
+    # The exact match is found even though it comes after more than drain_limit bytes.
+    assert validator.validate(["carol"]) == {"carol": True}
+    assert response.read == len(response.body)
+
+    # After an exact match, only about drain_limit more bytes are read, so pending names beyond that need their own
+    # search, even if the limit falls in the middle of an element.
+    response.read = 0
+    assert validator.validate(["alice", "bob"], concurrency=1) == {"alice": True, "bob": True}
+    assert response.read <= limit + 2 * response.chunk_size
+    assert fake_client.searches == ["carol", "alice", "bob"]
+
+def test_search_failure_is_passed_to_waiters(fake_client):
+    fake_client.responses["alice"] = FakeResponse([])
+    fake_client.responses["alice"].body = b'{"subjects": [{"id": "al'
+    with pytest.raises(ValueError, match="missing or truncated"):
+        client.SubjectValidator("qa").validate(["alice"])
+
+class RetryResponse:
+    """
+    A response that records whether it was closed.
+    """
+
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = b""
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+def test_response_closed_before_waiting_to_retry(monkeypatch, tmp_path):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv("TERRAIN_QA_RATE_LIMIT", "0")
+    responses = [RetryResponse(503, {"Retry-After": "2"}), RetryResponse(200)]
+    sleeps = []
+    terrain = client.TerrainClient("qa", retries=1)
+    monkeypatch.setattr(terrain.session, "request", lambda *args, **kwargs: responses[len(sleeps)])
+    monkeypatch.setattr(client.time, "sleep", lambda seconds: sleeps.append((seconds, responses[0].closed)))
+    assert terrain.get("/subjects", with_token=False, stream=True) is responses[1]
+    assert sleeps == [(2, True)]
+    assert not responses[1].closed
@@ -0,0 +1,20 @@
+import journal
+
+def test_resume_after_partial_final_line(tmp_path):
+    path = tmp_path / "manifest.csv.journal"
+    path.write_text('{"key": "a", "status": "done"}\n["a"]\n"b"\n{"key": "b", "sta')
+    with journal.Journal(str(path), resume=True) as j:
+        assert j.is_done("a")
+        assert not j.is_done("b")
+        j.record("c", "done")
+    with journal.Journal(str(path), resume=True) as j:
+        assert j.statuses == {"a": "done", "c": "done"}
+
+def test_resume_after_complete_lines(tmp_path):
+    path = tmp_path / "manifest.csv.journal"
+    path.write_text('{"key": "a", "status": "failed"}\n')
+    with journal.Journal(str(path), resume=True) as j:
+        j.record("a", "done")
+    assert path.read_text().count("\n") == 2
+    with journal.Journal(str(path), resume=True) as j:
+        assert j.is_done("a")
@@ -0,0 +1,60 @@
+import pytest
+import quotas
+
+def test_binary_and_si_byte_units():
+    assert quotas.convert("1k", "bytes") == 1024
+    assert quotas.convert("1KiB", "bytes") == 1024
+    assert quotas.convert("1kb", "bytes") == 1000
+    assert quotas.convert("1.5G", "bytes") == 3 * 2**29
+    assert quotas.convert("2GB", "bytes") == 2 * 10**9
+    assert quotas.convert("512", "bytes") == 512
+
+def test_legacy_units_for_unknown_resource_types():
+    assert quotas.convert("1m") == 2**20
+    with pytest.raises(ValueError, match="unknown unit 'kb'"):
+        quotas.convert("1kb")
+
+def test_m_means_minutes_for_cpu_hours():
+    assert quotas.convert("90m", "cpu hours") == 1.5
+    assert quotas.convert("30min", "cpu hours") == 0.5
+    assert quotas.convert("2d", "cpu hours") == 48
+    assert quotas.convert("1w", "cpu hours") == 168
+    with pytest.raises(ValueError, match="unknown unit 'g'"):
+        quotas.convert("1g", "cpu hours")
+
+def test_relative_expressions():
+    assert quotas.convert("+10%", "bytes", quota=1000) == 1100
+    assert quotas.convert("-1k", "bytes", quota=4096) == 3072
+    assert quotas.convert("usage*2", "cpu hours", usage=12.5) == 25
+    assert quotas.convert("quota+5G", "bytes", quota=2**30) == 6 * 2**30
+    assert quotas.compile_quota("usage*2", "hours").relative
+    assert not quotas.compile_quota("10G", "bytes").relative
+
+def test_relative_expression_errors():
+    with pytest.raises(ValueError, match="no current usage"):
+        quotas.convert("usage*2", "bytes")
+    with pytest.raises(ValueError, match="negative"):
+        quotas.convert("-2G", "bytes", quota=2**30)
+    with pytest.raises(ValueError, match="division by zero"):
+        quotas.convert("quota/0", "bytes", quota=1)
+    with pytest.raises(ValueError, match="must be relative"):
+        quotas.convert("10%", "bytes")
+    with pytest.raises(ValueError, match="not a valid quota expression"):
+        quotas.convert("ten gigs", "bytes")
+
+def test_convert_column_rejects_relative_specs():
+    assert quotas.convert_column(["10G", "+10%", "10G", "usage*2", "bogus"], "bytes") == [
+        (10 * 2**30, None),
+        (None, "+10%: relative quotas aren't allowed here"),
+        (10 * 2**30, None),
+        (None, "usage*2: relative quotas aren't allowed here"),
+        (None, "bogus: not a valid quota expression"),
+    ]
+
+def test_large_values_stay_exact():
+    assert quotas.convert("1.1T", "bytes") == 1209462790553
+    assert quotas.convert("3.3P", "bytes") == 3715469692580659
+    assert quotas.convert("9.999999999999999PB", "bytes") == 9999999999999999
+    assert quotas.convert("quota+1", "bytes", quota=2**53) == 2**53 + 1
+    assert type(quotas.convert("1.5h", "cpu hours")) is float
+    assert type(quotas.convert("2h", "cpu hours")) is int
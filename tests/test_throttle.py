@@ -0,0 +1,127 @@
+import pytest
+
+import throttle
+
+class FakeClock:
+    """
+    Stands in for the time module so that tests control the passage of time.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(throttle, "time", fake)
+    return fake
+
+def warmed_up(clock, limit=8, elapsed=0.1):
+    """
+    Returns a controller whose response time averages have been established by one successful request.
+    """
+    controller = throttle.ConcurrencyController(initial=limit, maximum=32)
+    controller.acquire()
+    controller.release(200, elapsed)
+    controller.limit = float(limit)
+    return controller
+
+@pytest.mark.parametrize("status", [429, 503, None])
+def test_overload_halves_the_limit(clock, status):
+    controller = warmed_up(clock)
+    controller.acquire()
+    controller.release(status, 0.1)
+    assert controller.limit == 4
+    assert controller.in_flight == 0
+
+def test_limit_is_cut_at_most_once_per_smoothed_response_time(clock):
+    controller = warmed_up(clock, limit=16)
+    for _ in range(3):
+        controller.acquire()
+        controller.release(429, 0.1)
+    assert controller.limit == 8
+    clock.now += 0.1
+    controller.acquire()
+    controller.release(503, 0.1)
+    assert controller.limit == 4
+
+def test_limit_never_drops_below_the_minimum(clock):
+    controller = warmed_up(clock, limit=2)
+    for _ in range(5):
+        clock.now += 1
+        controller.acquire()
+        controller.release(None, 0.1)
+    assert controller.limit == 1
+
+def test_rising_response_time_cuts_the_limit(clock):
+    controller = warmed_up(clock, elapsed=0.1)
+    controller.acquire()
+    controller.release(200, 2.0)
+    assert controller.limit == 4
+
+def test_limit_grows_additively_only_while_in_use(clock):
+    controller = warmed_up(clock, limit=4)
+    for _ in range(10):
+        controller.acquire()
+        controller.release(200, 0.1)
+    assert controller.limit == 4
+
+    for _ in range(4):
+        controller.acquire()
+    controller.release(200, 0.1)
+    assert controller.limit == 4.25
+    assert controller.in_flight == 3
+
+def test_limit_never_grows_above_the_maximum(clock):
+    controller = throttle.ConcurrencyController(initial=2, maximum=2)
+    controller.acquire()
+    controller.acquire()
+    controller.release(200, 0.1)
+    assert controller.limit == 2
+
+def test_cancel_frees_a_slot_without_changing_the_limit(clock):
+    controller = throttle.ConcurrencyController(initial=1)
+    controller.acquire()
+    assert not controller.try_acquire()
+    controller.cancel()
+    assert controller.limit == 1
+    assert controller.try_acquire()
+
+def test_throttle_acquire_frees_its_slot_when_interrupted(clock):
+    t = throttle.Throttle(rate=1, burst=1, initial_concurrency=1)
+
+    def interrupt(seconds):
+        raise KeyboardInterrupt()
+
+    t.acquire()
+    t.release(200, 0.1)
+    clock.sleep = interrupt
+    with pytest.raises(KeyboardInterrupt):
+        t.acquire()
+    assert t.controller.in_flight == 0
+
+def test_rate_limiter_delays_requests_to_pay_off_debt(clock):
+    limiter = throttle.RateLimiter(10, burst=2)
+    assert [limiter.reserve() for _ in range(4)] == pytest.approx([0, 0, 0.1, 0.2])
+    clock.now += 0.1
+    assert limiter.reserve() == pytest.approx(0.2)
+    clock.now += 0.4
+    assert limiter.reserve() == pytest.approx(0)
+
+def test_rate_limiter_acquire_sleeps_for_the_delay(clock):
+    limiter = throttle.RateLimiter(4, burst=1)
+    limiter.acquire()
+    limiter.acquire()
+    assert clock.sleeps == [pytest.approx(0.25)]
+
+def test_rate_limiter_without_a_rate_never_waits(clock):
+    limiter = throttle.RateLimiter(None)
+    assert all(limiter.reserve() == 0 for _ in range(100))
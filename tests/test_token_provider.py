@@ -0,0 +1,110 @@
+import base64
+import json
+import threading
+import time
+
+import pytest
+
+import client
+import jwt
+
+def make_token(issued, lifetime, username="someuser"):
+    """
+    Builds an unsigned JWT issued at the given time.
+    """
+    encode = lambda value: base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip("=")
+    payload = {"iat": issued, "exp": issued + lifetime, "preferred_username": username}
+    return "{0}.{1}.signature".format(encode({"alg": "none"}), encode(payload))
+
+class FakeTime:
+    """
+    Stands in for the time module in the client module so that tests control when tokens are due to be replaced. The
+    tokens themselves are issued at the real time, so they remain valid throughout each test.
+    """
+
+    def __init__(self):
+        self.now = time.time()
+
+    def time(self):
+        return self.now
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(client, "time", fake)
+    return fake
+
+@pytest.fixture
+def provider(tmp_path, monkeypatch, clock):
+    """
+    Returns a token provider for the QA environment with configured credentials and a token in the token file. The
+    provider's reissue method is replaced by the function assigned to provider.reissue_stub.
+    """
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv("TERRAIN_QA_USERNAME", "someuser")
+    monkeypatch.setenv("TERRAIN_QA_PASSWORD", "secret")
+    (tmp_path / ".terrain-qa").write_text(make_token(int(clock.now), 3600) + "\n")
+    p = client.AccessTokenProvider("qa", expiration_margin=30, refresh_threshold=300, retry_interval=30)
+    p.reissue_calls = 0
+
+    def reissue():
+        p.reissue_calls += 1
+        return p.reissue_stub()
+    p.reissue = reissue
+    return p
+
+def test_token_is_kept_until_refresh_time(provider, clock):
+    token = provider.get_token()
+    assert provider.refresh_at == pytest.approx(clock.now + 3600 - 30 - 300, abs=1)
+    clock.now = provider.refresh_at - 1
+    assert provider.get_token() == token
+    assert not provider.refresh_lock.locked()
+    assert provider.reissue_calls == 0
+
+def test_one_refresh_at_a_time_while_callers_keep_the_current_token(provider, clock):
+    token = provider.get_token()
+    new_token = make_token(int(time.time()), 3600)
+    started, finish = threading.Event(), threading.Event()
+
+    def reissue():
+        started.set()
+        finish.wait(5)
+        return new_token
+    provider.reissue_stub = reissue
+
+    clock.now = provider.refresh_at
+    assert provider.get_token() == token
+    assert started.wait(5)
+    assert [provider.get_token() for _ in range(10)] == [token] * 10
+    finish.set()
+    wait_for(lambda: not provider.refresh_lock.locked())
+    assert provider.reissue_calls == 1
+    assert provider.get_token() == new_token
+
+def test_failed_refresh_is_retried_after_retry_interval(provider, clock):
+    token = provider.get_token()
+    provider.reissue_stub = lambda: None
+
+    clock.now = provider.refresh_at
+    assert provider.get_token() == token
+    wait_for(lambda: provider.reissue_calls == 1 and not provider.refresh_lock.locked())
+    assert provider.refresh_at == clock.now + 30
+    assert provider.get_token() == token
+    assert provider.reissue_calls == 1
+
+def test_refresh_time_halves_short_lifetimes():
+    assert jwt.refresh_time({"iat": 1000, "exp": 1100}, 300) == 1050
+    assert jwt.refresh_time({"iat": 1000, "exp": 1130}, 300, margin=30) == 1050
+    assert jwt.refresh_time({"iat": 1000, "exp": 5000}, 300) == 4700
+    assert jwt.refresh_time({"iat": 1000, "exp": 5000}, 300, margin=30) == 4670
+    assert jwt.refresh_time({"iat": 1000}, 300) is None
+    assert jwt.refresh_time(None, 300) is None
@@ -0,0 +1,24 @@
+import math
+import usage
+
+def test_usage_without_quota_goes_to_overflow_bucket():
+    aggregator = usage.UsageAggregator()
+    aggregator.add("u1", {"quotas": [], "usages": [{"resource_type": {"name": "cpu.hours"}, "usage": 5.0}]})
+    aggregator.add("u2", {
+        "quotas": [{"resource_type": {"name": "cpu.hours"}, "quota": 0}],
+        "usages": [{"resource_type": {"name": "cpu.hours"}, "usage": 1.0}],
+    })
+    stats = aggregator.resource_types["cpu.hours"]
+    assert stats.histogram[usage.histogram_buckets] == 2
+    summary = aggregator.summaries()[0]
+    assert summary["over_quota"] == 2
+    assert summary["percentiles"]["p50"] == math.inf
+    assert [entry["user"] for entry in summary["closest_to_quota"]] == ["u2", "u1"]
+
+def test_ratios_at_and_above_the_limit_go_to_overflow_bucket():
+    stats = usage.ResourceTypeUsage("data.size", top=0)
+    stats.add("u1", usage.histogram_limit, 1.0)
+    stats.add("u2", 1e300, 1e-300)
+    stats.add("u3", 0.5, 1.0)
+    assert stats.histogram[usage.histogram_buckets] == 2
+    assert stats.percentile(1) == 0.501
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+
+# The status codes that indicate that Terrain is overloaded.
+overload_status_codes = {429, 503}
+
+class RateLimiter:
+    """
+    A token bucket that limits the rate at which requests are sent. Tokens are added to the bucket at a fixed rate, up
+    to the burst size, and each request consumes one token. A rate of None disables the limit.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1, rate or 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Reserves a token and returns the number of seconds to wait before using it. Reservations are granted in the
+        order in which they're made, so the bucket may go into debt; the debt is paid off by the waiting time.
+        """
+        if self.rate is None:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def acquire(self):
+        """
+        Waits until a request may be sent.
+        """
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+class ConcurrencyController:
+    """
+    Limits the number of requests in flight using additive-increase, multiplicative-decrease. The limit grows by about
+    one for each round of successful requests and is cut in half when Terrain responds with one of the status codes in
+    overload_status_codes, or when the recent response time rises above latency_tolerance times the long-term response
+    time. Both response times are exponentially weighted moving averages; comparing them rather than individual requests
+    keeps a mix of fast and slow endpoints from looking like congestion. The limit is cut at most once per recent
+    response time so that a single burst of overload responses doesn't collapse it to the minimum.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=32, latency_tolerance=2.0, smoothing=0.2, long_smoothing=0.02):
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_tolerance = latency_tolerance
+        self.smoothing = smoothing
+        self.long_smoothing = long_smoothing
+        self.in_flight = 0
+        self.smoothed = None
+        self.baseline = None
+        self.decreased = 0
+        self.condition = threading.Condition()
+
+    def try_acquire(self):
+        """
+        Claims a slot for a request if one is available. Returns True if a slot was claimed.
+        """
+        with self.condition:
+            if self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    def acquire(self):
+        """
+        Waits until a slot is available for a request and claims it.
+        """
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def cancel(self):
+        """
+        Releases the slot claimed for a request that was abandoned before it completed, without adjusting the limit.
+        """
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def release(self, status, elapsed):
+        """
+        Releases the slot claimed for a request and adjusts the limit based on the outcome of the request. The status is
+        None if no response was received, which is treated the same way as an overload response.
+        """
+        with self.condition:
+            self.in_flight -= 1
+            if status is not None and status not in overload_status_codes:
+                average = lambda current, weight: elapsed if current is None else \
+                    weight * elapsed + (1 - weight) * current
+                self.smoothed = average(self.smoothed, self.smoothing)
+                self.baseline = average(self.baseline, self.long_smoothing)
+
+            overloaded = status is None or status in overload_status_codes or (
+                self.smoothed is not None and self.smoothed > self.latency_tolerance * self.baseline
+            )
+            now = time.monotonic()
+            if overloaded and now - self.decreased >= (self.smoothed or 0):
+                self.limit = max(self.minimum, self.limit / 2)
+                self.decreased = now
+            elif not overloaded and self.in_flight + 1 >= int(self.limit):
+                # Only grow the limit when it's actually being used; otherwise it would grow without bound while the
+                # caller sends requests at a lower concurrency.
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+class Throttle:
+    """
+    Combines a rate limiter and a concurrency controller. Every request sent to an environment passes through the same
+    throttle so that the limits apply across all of the threads and clients that are talking to it.
+    """
+
+    def __init__(self, rate=None, burst=None, initial_concurrency=4, max_concurrency=32, latency_tolerance=2.0):
+        self.rate_limiter = RateLimiter(rate, burst)
+        self.controller = ConcurrencyController(initial_concurrency, 1, max_concurrency, latency_tolerance)
+
+    def acquire(self):
+        """
+        Waits until a request may be sent.
+        """
+        self.controller.acquire()
+        try:
+            self.rate_limiter.acquire()
+        except BaseException:
+            self.controller.cancel()
+            raise
+
+    async def acquire_async(self):
+        """
+        Waits until a request may be sent without blocking the event loop. The concurrency controller is shared with
+        threads that block on it, so it's polled rather than awaited.
+        """
+        import asyncio
+
+        while not self.controller.try_acquire():
+            await asyncio.sleep(0.01)
+        delay = self.rate_limiter.reserve()
+        if delay > 0:
+            try:
+                await asyncio.sleep(delay)
+            except BaseException:
+                self.controller.cancel()
+                raise
+
+    def release(self, status, elapsed):
+        """
+        Reports the outcome of a request sent after calling acquire.
+        """
+        self.controller.release(status, elapsed)
+
+    def cancel(self):
+        """
+        Reports that a request was abandoned after calling acquire, either because it was cancelled or because it failed
+        for a reason that says nothing about how well Terrain is keeping up.
+        """
+        self.controller.cancel()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+import client
+import json
+import re
+import sys
+import threading
+import time
+
+# Patterns used to group requests for similar resources together in the summary. User and plan names are replaced with
+# placeholders so that, for example, the subscription lookups for every user are reported as a single endpoint.
+path_patterns = [
+    (re.compile(r"^/admin/qms/users/[^/]+/plan/[^/]+/quota$"), "/admin/qms/users/{user}/plan/{resource_type}/quota"),
+    (re.compile(r"^/admin/qms/users/[^/]+/plan/[^/]+$"), "/admin/qms/users/{user}/plan/{plan}"),
+    (re.compile(r"^/admin/qms/users/[^/]+/plan$"), "/admin/qms/users/{user}/plan"),
+]
+
+def endpoint(path):
+    """
+    Returns the endpoint template for a request path.
+    """
+    for pattern, template in path_patterns:
+        if pattern.match(path):
+            return template
+    return path
+
+class Tracer:
+    """
+    Records the timing of every request sent to Terrain while a command runs. Once the command completes, the tracer
+    can display a summary of the time spent per endpoint and write the individual requests to a JSON timeline file.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counter = time.perf_counter()
+        self.elapsed = None
+
+    def record(self, event):
+        """
+        Records a single request. This is registered as a client request hook.
+        """
+        with self.lock:
+            self.events.append(event)
+
+    def install(self):
+        """
+        Starts recording requests.
+        """
+        client.add_request_hook(self.record)
+
+    def uninstall(self):
+        """
+        Stops recording requests.
+        """
+        client.remove_request_hook(self.record)
+
+    def finish(self):
+        """
+        Stops the command timer.
+        """
+        self.elapsed = time.perf_counter() - self.counter
+
+    def report(self, display, path=None):
+        """
+        Stops the command timer, then displays the summary if requested and writes the timeline if a path is given.
+        """
+        self.finish()
+        if display:
+            self.display_summary()
+        if path is not None:
+            self.write_timeline(path)
+
+    def summary(self):
+        """
+        Returns a list of per-endpoint summaries, sorted by the total time spent on each endpoint.
+        """
+        endpoints = {}
+        for event in self.events:
+            key = (event["environment"], event["method"], endpoint(event["path"]))
+            if key not in endpoints:
+                endpoints[key] = {"requests": 0, "errors": 0, "bytes": 0, "total": 0.0, "max": 0.0}
+            stats = endpoints[key]
+            stats["requests"] += 1
+            stats["bytes"] += event["bytes"]
+            stats["total"] += event["elapsed"]
+            stats["max"] = max(stats["max"], event["elapsed"])
+            if event["status"] is None or event["status"] >= 400:
+                stats["errors"] += 1
+        summaries = [
+            dict(environment=environment, method=method, endpoint=path, **stats)
+            for (environment, method, path), stats in endpoints.items()
+        ]
+        return sorted(summaries, key=lambda s: s["total"], reverse=True)
+
+    def display_summary(self, stream=None):
+        """
+        Displays a summary of the requests sent while the command ran. Request times overlap when requests are sent
+        concurrently, so the total request time may exceed the command's wall-clock time.
+        """
+        stream = stream if stream is not None else sys.stderr
+        request_time = sum(event["elapsed"] for event in self.events)
+        print("", file=stream)
+        print("Command Time: {0:.3f}s".format(self.elapsed), file=stream)
+        print("Requests: {0} ({1:.3f}s total)".format(len(self.events), request_time), file=stream)
+        if len(self.events) > 0:
+            print("{0:>8} {1:>6} {2:>10} {3:>10} {4:>10} {5:>10}  {6}".format(
+                "requests", "errors", "bytes", "total", "mean", "max", "endpoint"
+            ), file=stream)
+        for s in self.summary():
+            print("{0:>8} {1:>6} {2:>10} {3:>9.3f}s {4:>9.3f}s {5:>9.3f}s  {6} {7}".format(
+                s["requests"], s["errors"], s["bytes"], s["total"], s["total"] / s["requests"], s["max"], s["method"],
+                s["endpoint"]
+            ), file=stream)
+
+    def write_timeline(self, path):
+        """
+        Writes every recorded request to a JSON file. Request start times are relative to the start of the command.
+        """
+        timeline = {
+            "started": self.started,
+            "elapsed": self.elapsed,
+            "requests": [dict(event, start=event["start"] - self.started) for event in self.events],
+        }
+        with open(path, "w") as f:
+            json.dump(timeline, f, indent=2)
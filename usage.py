@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+import heapq
+import math
+
+# The ratio histogram covers usage ratios from 0 to histogram_limit in buckets of histogram_resolution. Larger ratios,
+# including those for users who have usage without a quota, are counted in a single overflow bucket.
+histogram_resolution = 0.001
+histogram_limit = 2.0
+histogram_buckets = int(histogram_limit / histogram_resolution)
+
+# The percentiles included in each report.
+report_percentiles = [50, 90, 95, 99]
+
+def usage_ratio(usage, quota):
+    """
+    Returns the ratio of a usage to its quota. A usage without a quota is treated as infinitely far over quota.
+    """
+    if quota > 0:
+        return usage / quota
+    return math.inf if usage > 0 else 0.0
+
+class ResourceTypeUsage:
+    """
+    Incrementally aggregated usage statistics for a single resource type. The amount of memory used is constant
+    regardless of how many users are added: percentiles are estimated from a fixed-size histogram of usage ratios, and
+    only the top users closest to their quotas are retained.
+    """
+
+    def __init__(self, name, top):
+        self.name = name
+        self.top = top
+        self.users = 0
+        self.total_quota = 0.0
+        self.total_usage = 0.0
+        self.over_quota = 0
+        self.histogram = [0] * (histogram_buckets + 1)
+        self.closest = []
+
+    def add(self, user, usage, quota):
+        """
+        Adds the usage and quota of a single user to the statistics.
+        """
+        ratio = usage_ratio(usage, quota)
+        self.users += 1
+        self.total_quota += quota
+        self.total_usage += usage
+        if ratio > 1:
+            self.over_quota += 1
+        # Check the limit before converting to a bucket index; int() can't convert the infinite ratio of a user who has
+        # usage without a quota.
+        bucket = histogram_buckets if ratio >= histogram_limit else int(ratio / histogram_resolution)
+        self.histogram[bucket] += 1
+        entry = (ratio, user, usage, quota)
+        if len(self.closest) < self.top:
+            heapq.heappush(self.closest, entry)
+        elif self.top > 0 and entry > self.closest[0]:
+            heapq.heapreplace(self.closest, entry)
+
+    def percentile(self, p):
+        """
+        Estimates a usage ratio percentile from the histogram. The upper bound of the bucket containing the percentile
+        is returned, so the estimate is never lower than the actual value. Infinity is returned if the percentile falls
+        in the overflow bucket.
+        """
+        if self.users == 0:
+            return None
+        rank = math.ceil(self.users * p / 100)
+        seen = 0
+        for bucket, count in enumerate(self.histogram):
+            seen += count
+            if seen >= rank:
+                return (bucket + 1) * histogram_resolution if bucket < histogram_buckets else math.inf
+        return math.inf
+
+    def summary(self):
+        """
+        Returns a dictionary summarizing the usage statistics.
+        """
+        return {
+            "resource_type": self.name,
+            "users": self.users,
+            "total_quota": self.total_quota,
+            "total_usage": self.total_usage,
+            "usage_ratio": usage_ratio(self.total_usage, self.total_quota),
+            "over_quota": self.over_quota,
+            "percentiles": {"p{0}".format(p): self.percentile(p) for p in report_percentiles},
+            "closest_to_quota": [
+                {"user": user, "usage": usage, "quota": quota, "ratio": ratio}
+                for ratio, user, usage, quota in sorted(self.closest, reverse=True)
+            ],
+        }
+
+class UsageAggregator:
+    """
+    Aggregates usage statistics for each resource type across a stream of subscriptions.
+    """
+
+    def __init__(self, top=10):
+        self.top = top
+        self.subscriptions = 0
+        self.resource_types = {}
+
+    def add(self, user, subscription):
+        """
+        Adds a user's subscription to the statistics.
+        """
+        self.subscriptions += 1
+        quotas = {q["resource_type"]["name"]: q["quota"] for q in subscription.get("quotas") or []}
+        usages = {u["resource_type"]["name"]: u["usage"] for u in subscription.get("usages") or []}
+        for name in quotas.keys() | usages.keys():
+            if name not in self.resource_types:
+                self.resource_types[name] = ResourceTypeUsage(name, self.top)
+            self.resource_types[name].add(user, usages.get(name, 0.0), quotas.get(name, 0.0))
+
+    def summaries(self):
+        """
+        Returns the usage summaries for each resource type, sorted by resource type name.
+        """
+        return [self.resource_types[name].summary() for name in sorted(self.resource_types)]